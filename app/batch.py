@@ -0,0 +1,213 @@
+"""
+Wielordzeniowe liczenie dużych list płac.
+
+Payloady są dzielone na porcje i rozsyłane do puli procesów; każdy
+proces raz ładuje `payroll.clp` (inicjalizator) i liczy swoje porcje
+w jednej sesji silnika. Porcje i wyniki podróżują jako tekst JSON,
+a kolejność wyników odpowiada kolejności wejścia.
+
+    python -m app.batch lista.json -o wyniki.json --workers 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pydantic import ValidationError
+
+from app.engine import _new_environment, _run_session, get_rules
+from app.facts import CompiledEnvironment
+from app.schemas import PayrollPayload, PayrollResult
+
+DEFAULT_CHUNK_SIZE = 500
+
+_worker_env: Optional[CompiledEnvironment] = None
+
+
+# ───────────────────────────────────────────────────────────
+#  RAPORT
+# ───────────────────────────────────────────────────────────
+
+@dataclass
+class WorkerStats:
+    pid: int
+    items: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class BatchReport:
+    results: List[Union[PayrollResult, Exception]]
+    workers: Dict[int, WorkerStats] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+
+# ───────────────────────────────────────────────────────────
+#  PROCES ROBOCZY
+# ───────────────────────────────────────────────────────────
+
+def _init_worker() -> None:
+    global _worker_env
+    _worker_env = _new_environment()
+
+
+def _run_chunk(chunk: str) -> Tuple[int, int, float, str]:
+    """Liczy porcję (tablica JSON payloadów); zwraca tablicę JSON wyników."""
+    started = time.perf_counter()
+    items: List[Dict[str, Any]] = []
+    payloads: List[PayrollPayload] = []
+    slots: List[int] = []
+
+    raw = json.loads(chunk)
+    for idx, item in enumerate(raw):
+        meta = item.get("meta") if isinstance(item, dict) else None
+        calc_id = meta.get("calculationId") if isinstance(meta, dict) else None
+        items.append({"calculationId": calc_id})
+        try:
+            payloads.append(PayrollPayload.model_validate(item))
+        except ValidationError as ex:
+            items[idx]["error"] = str(ex)
+            continue
+        slots.append(idx)
+
+    try:
+        results = _run_session(_worker_env, payloads)
+    except Exception as ex:  # noqa: BLE001
+        # wyjątek z procesu roboczego przerwałby całe `_map_chunks` – błąd
+        # dostają tylko pozycje tej porcji
+        results = [ex] * len(slots)
+
+    for idx, res in zip(slots, results):
+        if isinstance(res, Exception):
+            items[idx]["error"] = str(res)
+        else:
+            items[idx]["result"] = res.model_dump(mode="json")
+
+    return os.getpid(), len(items), time.perf_counter() - started, json.dumps(items)
+
+
+# ───────────────────────────────────────────────────────────
+#  DZIELENIE NA PORCJE
+# ───────────────────────────────────────────────────────────
+
+def _encode_chunks(items: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """Skleja teksty JSON pojedynczych payloadów w tablice po `chunk_size`."""
+    chunk: List[str] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield "[" + ",".join(chunk) + "]"
+            chunk = []
+    if chunk:
+        yield "[" + ",".join(chunk) + "]"
+
+
+def _map_chunks(
+    chunks: Iterable[str], workers: Optional[int], stats: Dict[int, WorkerStats]
+) -> Iterator[str]:
+    get_rules().compile()       # procesy robocze ładują gotowy obraz (bload)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as ex:
+        for pid, count, seconds, out in ex.map(_run_chunk, chunks):
+            ws = stats.setdefault(pid, WorkerStats(pid))
+            ws.items += count
+            ws.chunks += 1
+            ws.seconds += seconds
+            yield out
+
+
+# ───────────────────────────────────────────────────────────
+#  API BIBLIOTECZNE
+# ───────────────────────────────────────────────────────────
+
+def run_batch(
+    payloads: Iterable[Union[PayrollPayload, Dict[str, Any]]],
+    workers: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> BatchReport:
+    """
+    Liczy payloady na `workers` procesach (domyślnie liczba rdzeni).
+    Wyniki w kolejności wejścia; nieudane pozycje to wyjątki.
+    """
+    def encoded() -> Iterator[str]:
+        for p in payloads:
+            yield p.model_dump_json() if isinstance(p, PayrollPayload) else json.dumps(p)
+
+    started = time.perf_counter()
+    report = BatchReport(results=[])
+    for out in _map_chunks(_encode_chunks(encoded(), chunk_size), workers, report.workers):
+        for item in json.loads(out):
+            if "result" in item:
+                report.results.append(PayrollResult.model_validate(item["result"]))
+            else:
+                report.results.append(RuntimeError(item["error"]))
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+# ───────────────────────────────────────────────────────────
+#  CLI
+# ───────────────────────────────────────────────────────────
+
+def _read_items(path: str) -> Iterator[str]:
+    """Tablica JSON lub JSON Lines – zwraca tekst JSON każdego payloadu."""
+    with open(path, encoding="utf-8") as fh:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in fh:
+                if line.strip():
+                    yield line.strip()
+        else:
+            for item in json.load(fh):
+                yield json.dumps(item)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.batch",
+                                     description="Wsadowe liczenie listy płac na wielu rdzeniach.")
+    parser.add_argument("input", help="plik .json (tablica) lub .jsonl z payloadami")
+    parser.add_argument("-o", "--output", help="plik wynikowy JSON (domyślnie stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-c", "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    stats: Dict[int, WorkerStats] = {}
+    started = time.perf_counter()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        out.write("[")
+        first = True
+        for chunk in _map_chunks(_encode_chunks(_read_items(args.input), args.chunk_size),
+                                 args.workers, stats):
+            body = chunk[1:-1]
+            if body:
+                out.write(body if first else "," + body)
+                first = False
+        out.write("]\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    total = sum(ws.items for ws in stats.values())
+    for ws in sorted(stats.values(), key=lambda w: w.pid):
+        print(f"worker {ws.pid}: {ws.items} obliczeń w {ws.chunks} porcjach, "
+              f"{ws.throughput:.0f}/s", file=sys.stderr)
+    print(f"razem: {total} obliczeń w {elapsed:.2f} s "
+          f"({total / elapsed if elapsed else 0:.0f}/s)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
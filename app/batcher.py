@@ -0,0 +1,242 @@
+"""
+Mikro-partie: łączenie współbieżnych żądań `/calculate` w jedną sesję silnika.
+
+Żądania trafiają do ograniczonej kolejki asyncio. Dyspozytor zbiera je
+w partie (do PAYROLL_MICROBATCH_SIZE pozycji albo PAYROLL_MICROBATCH_WAIT_MS
+od pierwszej), a każdą partię liczy `run_payroll_batch_cached` w puli
+wątków – poza pętlą zdarzeń. Każdy wywołujący dostaje własny wynik albo
+wyjątek przez swój `Future`.
+
+Przeciążenie nie odkłada się w puli wątków: w locie jest najwyżej
+PAYROLL_MICROBATCH_CONCURRENCY partii, pełna kolejka odrzuca nowe żądania
+od razu (`QueueFull` → 429), a żądanie, które czekało dłużej niż
+PAYROLL_MICROBATCH_QUEUE_TIMEOUT_MS, nie jest już liczone (`QueueTimeout` → 429).
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Union
+
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.cache import run_payroll_batch_cached
+from app.schemas import PayrollPayload, PayrollResult
+
+MICROBATCH = os.getenv("PAYROLL_MICROBATCH", "1").lower() not in ("0", "false", "no")
+MAX_BATCH = int(os.getenv("PAYROLL_MICROBATCH_SIZE", "64"))
+MAX_WAIT = float(os.getenv("PAYROLL_MICROBATCH_WAIT_MS", "2")) / 1e3
+QUEUE_SIZE = int(os.getenv("PAYROLL_MICROBATCH_QUEUE", "1024"))
+QUEUE_TIMEOUT = float(os.getenv("PAYROLL_MICROBATCH_QUEUE_TIMEOUT_MS", "1000")) / 1e3
+CONCURRENCY = int(os.getenv("PAYROLL_MICROBATCH_CONCURRENCY", "8"))
+
+Runner = Callable[[Sequence[PayrollPayload], Optional[str]],
+                  List[Union[PayrollResult, Exception]]]
+
+
+# ───────────────────────────────────────────────────────────
+#  WYJĄTKI
+# ───────────────────────────────────────────────────────────
+
+class QueueFull(Exception):
+    """Kolejka mikro-partii jest pełna – żądanie odrzucone od razu."""
+
+
+class QueueTimeout(Exception):
+    """Żądanie czekało w kolejce dłużej niż pozwala limit."""
+
+
+class BatcherClosed(Exception):
+    """Mikro-partie zostały zatrzymane (zamykanie aplikacji)."""
+
+
+# ───────────────────────────────────────────────────────────
+#  MIKRO-PARTIE
+# ───────────────────────────────────────────────────────────
+
+class _Item:
+    __slots__ = ("payload", "engine", "future", "enqueued", "trace")
+
+    def __init__(self, payload: PayrollPayload, engine: Optional[str],
+                 future: "asyncio.Future[PayrollResult]") -> None:
+        self.payload = payload
+        self.engine = engine
+        self.future = future
+        self.enqueued = time.perf_counter()
+        self.trace = metrics.current()
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        runner: Runner = run_payroll_batch_cached,
+        max_batch: int = MAX_BATCH,
+        max_wait: float = MAX_WAIT,
+        queue_size: int = QUEUE_SIZE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        concurrency: int = CONCURRENCY,
+    ) -> None:
+        if max_batch < 1 or concurrency < 1:
+            raise ValueError("rozmiar partii i współbieżność muszą być >= 1")
+        self.runner = runner
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.concurrency = concurrency
+
+        self._queue: Optional["asyncio.Queue[_Item]"] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional["asyncio.Task[None]"] = None
+        self._running: Set["asyncio.Task[None]"] = set()
+        self._pending: List[_Item] = []     # partia zbierana albo czekająca na slot
+
+        # ── metryki
+        self._submitted = 0
+        self._rejected = 0
+        self._expired = 0
+        self._batches = 0
+        self._batched = 0
+        self._largest = 0
+
+    # ── cykl życia ───────────────────────────────────────────
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(self.queue_size)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="payroll-microbatch")
+
+    async def stop(self) -> None:
+        """
+        Kończy partie w locie; żądania jeszcze w kolejce i w partii, która
+        nie trafiła do liczenia, dostają `BatcherClosed`.
+        """
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        self._dispatcher = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        leftover, self._pending = self._pending, []
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait())
+        for item in leftover:
+            if not item.future.done():
+                item.future.set_exception(BatcherClosed("mikro-partie zatrzymane"))
+
+    # ── przyjmowanie żądań ───────────────────────────────────
+
+    async def submit(self, payload: PayrollPayload, engine: Optional[str] = None) -> PayrollResult:
+        if self._dispatcher is None:
+            raise BatcherClosed("mikro-partie nie są uruchomione")
+        item = _Item(payload, engine, asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise QueueFull(f"kolejka obliczeń pełna ({self.queue_size})") from None
+        self._submitted += 1
+        return await item.future
+
+    # ── zbieranie i liczenie partii ──────────────────────────
+
+    async def _collect(self) -> List[_Item]:
+        """
+        Bierze wszystko, co już czeka. Na kolejne żądania czeka (do `max_wait`)
+        tylko wtedy, gdy silnik i tak liczy inną partię – pojedyncze żądanie
+        przy bezczynnym silniku nie płaci opóźnienia.
+        """
+        queue = self._queue
+        batch = self._pending           # widoczna dla `stop()`, gdy dyspozytor zostanie anulowany
+        batch.append(await queue.get())
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            if not self._running:
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self) -> None:
+        while True:
+            batch = await self._collect()
+            await self._slots.acquire()        # najwyżej `concurrency` partii w locie
+            self._pending = []
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[_Item]) -> None:
+        try:
+            started = time.perf_counter()
+            groups: Dict[Optional[str], List[_Item]] = defaultdict(list)
+            for item in batch:
+                if item.future.done():              # klient się rozłączył
+                    continue
+                if started - item.enqueued > self.queue_timeout:
+                    self._expired += 1
+                    item.future.set_exception(QueueTimeout(
+                        f"żądanie czekało w kolejce {(started - item.enqueued) * 1e3:.0f} ms"))
+                    continue
+                groups[item.engine].append(item)
+
+            for engine, items in groups.items():
+                await self._run_group(engine, items, started)
+        finally:
+            self._slots.release()
+
+    async def _run_group(self, engine: Optional[str], items: List[_Item], started: float) -> None:
+        self._batches += 1
+        self._batched += len(items)
+        self._largest = max(self._largest, len(items))
+
+        # ślad partii: etapy silnika trafiają do śladów wszystkich żądań,
+        # liczniki (fakty, reguły) – raz, do rejestru
+        trace = metrics.Trace() if metrics.ENABLED else None
+        try:
+            with metrics.traced(trace):
+                results = await run_in_threadpool(
+                    self.runner, [item.payload for item in items], engine)
+        except Exception as ex:  # noqa: BLE001
+            results = [ex] * len(items)
+
+        if trace is not None:
+            metrics.registry.absorb(trace)
+        for item, res in zip(items, results):
+            if item.trace is not None:
+                item.trace.add("queue", started - item.enqueued)
+                item.trace.merge_stages(trace)
+            if item.future.done():
+                continue
+            if isinstance(res, Exception):
+                item.future.set_exception(res)
+            else:
+                item.future.set_result(res)
+
+    # ── diagnostyka ──────────────────────────────────────────
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "running": self._dispatcher is not None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queueSize": self.queue_size,
+            "inFlight": len(self._running),
+            "maxBatch": self.max_batch,
+            "maxWaitMs": self.max_wait * 1e3,
+            "submitted": self._submitted,
+            "rejected": self._rejected,
+            "expired": self._expired,
+            "batches": self._batches,
+            "avgBatch": round(self._batched / self._batches, 2) if self._batches else 0.0,
+            "largestBatch": self._largest,
+        }
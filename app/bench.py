@@ -0,0 +1,227 @@
+"""
+Powtarzalny benchmark kalkulatora płac.
+
+Mierzy poszczególne etapy obliczenia (walidacja pydantic, wstawianie
+faktów, `reset()`/`run()`, zbieranie wyników, serializacja odpowiedzi) na
+syntetycznych payloadach z `app.synthetic`, a następnie `/calculate`
+end-to-end przez aplikację ASGI w procesie, przy kilku poziomach
+współbieżności. Wynik to JSON z p50/p95/p99 i przepustowością, który
+można porównać z zapisanym punktem odniesienia.
+
+    python -m app.bench -n 2000 -o bench.json
+    python -m app.bench -n 2000 --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+STAGES = ("validation", "reset", "assert", "run", "collect", "serialize", "total")
+DEFAULT_CONCURRENCY = (1, 8, 32)
+
+
+# ───────────────────────────────────────────────────────────
+#  STATYSTYKI
+# ───────────────────────────────────────────────────────────
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    idx = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+def summarize(samples: Sequence[float], wall: Optional[float] = None) -> Dict[str, float]:
+    """Czasy w sekundach → statystyki w milisekundach i operacje/s."""
+    ordered = sorted(samples)
+    total = wall if wall is not None else sum(ordered)
+    return {
+        "count": len(ordered),
+        "meanMs": round(sum(ordered) / len(ordered) * 1e3, 4) if ordered else 0.0,
+        "p50Ms": round(_percentile(ordered, 0.50) * 1e3, 4),
+        "p95Ms": round(_percentile(ordered, 0.95) * 1e3, 4),
+        "p99Ms": round(_percentile(ordered, 0.99) * 1e3, 4),
+        "maxMs": round(ordered[-1] * 1e3, 4) if ordered else 0.0,
+        "throughput": round(len(ordered) / total, 1) if total else 0.0,
+    }
+
+
+# ───────────────────────────────────────────────────────────
+#  ETAPY
+# ───────────────────────────────────────────────────────────
+
+def bench_stages(raw: List[Dict[str, Any]], warmup: int = 50) -> Dict[str, Dict[str, float]]:
+    from app.engine import _build_result, _new_environment
+    from app.schemas import PayrollPayload
+
+    env = _new_environment()
+    timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    clock = time.perf_counter
+
+    for idx, item in enumerate(raw):
+        t0 = clock()
+        payload = PayrollPayload.model_validate(item)
+        t1 = clock()
+        env.env.reset()
+        t1r = clock()
+        env.assert_payload(payload, 0)
+        t2 = clock()
+        env.env.run()
+        t3 = clock()
+        result = _build_result(env.collect().get(0))
+        t4 = clock()
+        result.model_dump_json()
+        t5 = clock()
+
+        if idx < warmup:
+            continue
+        timings["validation"].append(t1 - t0)
+        timings["reset"].append(t1r - t1)
+        timings["assert"].append(t2 - t1r)
+        timings["run"].append(t3 - t2)
+        timings["collect"].append(t4 - t3)
+        timings["serialize"].append(t5 - t4)
+        timings["total"].append(t5 - t0)
+
+    return {stage: summarize(samples) for stage, samples in timings.items()}
+
+
+# ───────────────────────────────────────────────────────────
+#  END-TO-END HTTP (ASGI w procesie)
+# ───────────────────────────────────────────────────────────
+
+async def _http_level(app, raw: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    import httpx
+
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for item in raw:
+        queue.put_nowait(item)
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(client: "httpx.AsyncClient") -> None:
+        nonlocal errors
+        while not queue.empty():
+            item = queue.get_nowait()
+            started = time.perf_counter()
+            resp = await client.post("/calculate", json=item)
+            latencies.append(time.perf_counter() - started)
+            errors += resp.status_code != 200
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {**summarize(latencies, wall), "errors": errors}
+
+
+def bench_http(raw: List[Dict[str, Any]], levels: Sequence[int]) -> Dict[str, Any]:
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        return {"skipped": "brak pakietu httpx (pip install httpx)"}
+
+    from app.engine import get_pool
+    from app.main import app
+
+    get_pool()      # pula gotowa przed pomiarem
+    return {f"c{level}": asyncio.run(_http_level(app, raw, level)) for level in levels}
+
+
+# ───────────────────────────────────────────────────────────
+#  PORÓWNANIE Z PUNKTEM ODNIESIENIA
+# ───────────────────────────────────────────────────────────
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Lista regresji: p50/p95 wolniejsze lub przepustowość niższa o ponad
+    `tolerance`, a także pomiary obecne w baseline, a pominięte teraz.
+    """
+    regressions = []
+    for section in ("stages", "http"):
+        measured = current.get(section, {})
+        for name, base in baseline.get(section, {}).items():
+            # pominięty pomiar (np. brak httpx) nie może przejść jako „bez regresji”
+            if isinstance(base, dict) and "p50Ms" in base and "p50Ms" not in measured.get(name, {}):
+                reason = measured.get("skipped") or "brak pomiaru"
+                regressions.append(f"{section}.{name}: pominięty w bieżącym uruchomieniu ({reason})")
+        for name, cur in measured.items():
+            base = baseline.get(section, {}).get(name)
+            if not isinstance(base, dict) or "p50Ms" not in cur or "p50Ms" not in base:
+                continue
+            for metric in ("p50Ms", "p95Ms"):
+                if base[metric] and cur[metric] > base[metric] * (1 + tolerance):
+                    regressions.append(f"{section}.{name}.{metric}: "
+                                       f"{base[metric]} → {cur[metric]}")
+            if base["throughput"] and cur["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(f"{section}.{name}.throughput: "
+                                   f"{base['throughput']} → {cur['throughput']}")
+    return regressions
+
+
+# ───────────────────────────────────────────────────────────
+#  CLI
+# ───────────────────────────────────────────────────────────
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.bench",
+                                     description="Benchmark kalkulatora płac.")
+    parser.add_argument("-n", type=int, default=2000, help="liczba payloadów na pomiar")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="*", default=list(DEFAULT_CONCURRENCY),
+                        help="poziomy współbieżności HTTP (puste = bez HTTP)")
+    parser.add_argument("--cache", action="store_true",
+                        help="nie wyłączaj pamięci podręcznej wyników podczas pomiaru HTTP")
+    parser.add_argument("-o", "--output", help="zapisz wynik JSON do pliku")
+    parser.add_argument("--baseline", help="plik JSON z poprzedniego uruchomienia")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="dopuszczalne pogorszenie względem baseline (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if not args.cache:
+        os.environ["PAYROLL_CACHE_SIZE"] = "0"
+
+    from app.synthetic import iter_payloads
+
+    raw = [p.model_dump(mode="json") for p in iter_payloads(args.n, args.seed)]
+    report: Dict[str, Any] = {
+        "meta": {
+            "startedAt": datetime.now(timezone.utc).isoformat(),
+            "n": args.n,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "stages": bench_stages(raw),
+        "http": bench_http(raw, args.concurrency) if args.concurrency else {},
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+        for line in regressions:
+            print(f"REGRESJA {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("brak regresji względem baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
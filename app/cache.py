@@ -0,0 +1,256 @@
+"""
+Pamięć podręczna wyników obliczeń, adresowana treścią payloadu.
+
+Klucz to SHA-256 z kanonicznego JSON-a payloadu bez sekcji `meta`,
+silnika, który liczy, i odcisku aktualnej wersji reguł, więc przeładowanie `payroll.clp`
+automatycznie unieważnia wpisy. W pamięci: LRU z TTL, limitem wpisów i bajtów;
+opcjonalnie trwała kopia w SQLite (przeżywa restart, plik 0600, te same
+limity i TTL). Zapamiętany wynik zachowuje oryginalne `calculatedAt`.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from app.engine import _resolve_engine, get_rules, run_payroll_batch
+from app.ledger import _open_private
+from app.schemas import PayrollPayload, PayrollResult
+
+CACHE_SIZE = int(os.getenv("PAYROLL_CACHE_SIZE", "10000"))          # 0 → wyłączona
+CACHE_BYTES = int(os.getenv("PAYROLL_CACHE_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("PAYROLL_CACHE_TTL", "3600"))
+CACHE_PATH = os.getenv("PAYROLL_CACHE_PATH")                        # plik SQLite
+
+_TRIM_EVERY = 100          # co tyle zapisów tabela wraca do limitów
+
+_cache: Optional["ResultCache"] = None
+_cache_lock = threading.Lock()
+
+
+def _rules_digest() -> str:
+    return get_rules().digest
+
+
+# ───────────────────────────────────────────────────────────
+#  PAMIĘĆ PODRĘCZNA
+# ───────────────────────────────────────────────────────────
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = CACHE_SIZE,
+        max_bytes: int = CACHE_BYTES,
+        ttl: Optional[float] = CACHE_TTL,
+        path: Optional[str] = CACHE_PATH,
+        rules: Callable[[], str] = _rules_digest,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.fingerprint = rules
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._rules = self.fingerprint()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._disk_hits = 0
+        self._disk_evictions = 0
+        self._puts = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            if path != ":memory:":
+                _open_private(path)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                " key TEXT PRIMARY KEY, rules TEXT NOT NULL,"
+                " expires REAL, value BLOB NOT NULL)"
+            )
+            self._db.execute("DELETE FROM result_cache WHERE rules <> ?", (self._rules,))
+            self._trim()
+
+    # ── klucze ───────────────────────────────────────────────
+
+    def key(self, payload: PayrollPayload, engine: str = "clips") -> str:
+        body = payload.model_dump(mode="json", exclude={"meta"})
+        canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        digest = hashlib.sha256(self._check_rules().encode())
+        digest.update(engine.encode())            # wyniki silników nie mieszają się
+        digest.update(canonical.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _check_rules(self) -> str:
+        rules = self.fingerprint()
+        if rules != self._rules:
+            with self._lock:
+                self._entries.clear()
+                self._bytes = 0
+                self._rules = rules
+                if self._db is not None:
+                    self._db.execute("DELETE FROM result_cache WHERE rules <> ?", (rules,))
+        return rules
+
+    # ── odczyt / zapis ───────────────────────────────────────
+
+    def get(self, key: str) -> Optional[PayrollResult]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return PayrollResult.model_validate_json(entry[1])
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT expires, value FROM result_cache WHERE key = ? AND rules = ?",
+                    (key, self._rules),
+                ).fetchone()
+                if row is not None and (row[0] is None or row[0] >= now):
+                    self._hits += 1
+                    self._disk_hits += 1
+                    self._store(key, row[0] if row[0] is not None else float("inf"), row[1])
+                    return PayrollResult.model_validate_json(row[1])
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, result: PayrollResult) -> None:
+        value = result.model_dump_json().encode("utf-8")
+        expires = time.time() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._store(key, expires, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, rules, expires, value) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, self._rules, None if expires == float("inf") else expires, value),
+                )
+                self._puts += 1
+                if self._puts % _TRIM_EVERY == 0:
+                    self._trim()
+
+    def _store(self, key: str, expires: float, value: bytes) -> None:
+        if key in self._entries:
+            self._drop(key)
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (expires, value)
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._drop(old_key)
+            self._evictions += 1
+
+    def _drop(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def _trim(self) -> None:
+        """Usuwa z tabeli wpisy wygasłe, a potem najstarsze ponad limity."""
+        assert self._db is not None
+        cur = self._db.execute("DELETE FROM result_cache WHERE expires < ?", (time.time(),))
+        evicted = cur.rowcount
+        # INSERT OR REPLACE nadaje nowy rowid, więc rowid to kolejność zapisu
+        cur = self._db.execute(
+            "DELETE FROM result_cache WHERE rowid IN ("
+            " SELECT rowid FROM ("
+            "  SELECT rowid,"
+            "   ROW_NUMBER() OVER (ORDER BY rowid DESC) AS n,"
+            "   SUM(length(value)) OVER (ORDER BY rowid DESC) AS total"
+            "  FROM result_cache)"
+            " WHERE n > ? OR total > ?)",
+            (self.max_entries, self.max_bytes),
+        )
+        self._disk_evictions += evicted + cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM result_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxEntries": self.max_entries,
+                "maxBytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "diskHits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "diskEvictions": self._disk_evictions,
+                "hitRatio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+                "rules": self._rules[:12],
+            }
+
+
+def get_cache() -> Optional[ResultCache]:
+    """Wspólna pamięć podręczna procesu (None, gdy PAYROLL_CACHE_SIZE=0)."""
+    global _cache
+    if _cache is None and CACHE_SIZE > 0:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+
+# ───────────────────────────────────────────────────────────
+#  OBLICZENIA Z PAMIĘCIĄ PODRĘCZNĄ
+# ───────────────────────────────────────────────────────────
+
+def run_payroll_batch_cached(
+    payloads: Sequence[PayrollPayload], engine: Optional[str] = None
+) -> List[Union[PayrollResult, Exception]]:
+    """Jak `run_payroll_batch`, ale liczy tylko payloady nieobecne w pamięci."""
+    cache = get_cache()
+    if cache is None:
+        return run_payroll_batch(payloads, engine=engine)
+
+    engine = _resolve_engine(engine)
+    results: List[Union[PayrollResult, Exception, None]] = [None] * len(payloads)
+    missing: Dict[str, List[int]] = {}
+    for idx, payload in enumerate(payloads):
+        key = cache.key(payload, engine)
+        if key in missing:
+            missing[key].append(idx)          # identyczny payload w tej samej partii
+            continue
+        results[idx] = cache.get(key)
+        if results[idx] is None:
+            missing[key] = [idx]
+
+    if missing:
+        computed = run_payroll_batch([payloads[idxs[0]] for idxs in missing.values()],
+                                     engine=engine)
+        for (key, idxs), res in zip(missing.items(), computed):
+            for idx in idxs:
+                results[idx] = res
+            if not isinstance(res, Exception):
+                cache.put(key, res)
+    return results
+
+
+def run_payroll_cached(payload: PayrollPayload, engine: Optional[str] = None) -> PayrollResult:
+    result = run_payroll_batch_cached([payload], engine=engine)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
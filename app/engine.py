@@ -1,11 +1,46 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Any, Dict
-from clips import Environment
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+from app import metrics
+from app.facts import CompiledEnvironment
+from app.pool import EnginePool, PoolClosed
+from app.rulebase import RuleBase, RulesFingerprint
 from app.schemas import PayrollPayload, PayrollResult
 
-_clips_env = Environment()
-_clips_env.load("./app/rules/payroll.clp")
+# Ścieżka względem pakietu, nie katalogu roboczego.
+RULES_FILE = os.getenv("PAYROLL_RULES_FILE",
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    "rules", "payroll.clp"))
+
+# Rozmiar puli domyślnie odpowiada limitowi wątków, na które FastAPI
+# (anyio) rozdziela synchroniczne endpointy – 40 równoległych obliczeń.
+POOL_SIZE = int(os.getenv("PAYROLL_POOL_SIZE", "40"))
+POOL_TIMEOUT = float(os.getenv("PAYROLL_POOL_TIMEOUT", "10"))
+
+# Silnik domyślny: "clips" (reguły) albo "vector" (kolumnowy NumPy, app.vector).
+ENGINES = ("clips", "vector")
+ENGINE = os.getenv("PAYROLL_ENGINE", "clips")
+
+# Ile obliczeń trafia do jednej sesji silnika w trybie wsadowym.
+BATCH_CHUNK_SIZE = int(os.getenv("PAYROLL_BATCH_CHUNK_SIZE", "1000"))
+
+# Rozgrzanie przy starcie aplikacji: obraz reguł + cała pula (0 → leniwie).
+WARMUP = os.getenv("PAYROLL_WARMUP", "1").lower() not in ("0", "false", "no")
+
+# Co ile sekund sprawdzać, czy plik reguł się zmienił (0 → tylko ręczne przeładowanie).
+RULES_WATCH = float(os.getenv("PAYROLL_RULES_WATCH", "0"))
+
+log = logging.getLogger("app.engine")
+
+_rules: Optional[RuleBase] = None
+_pool: Optional[EnginePool[CompiledEnvironment]] = None
+_pool_lock = threading.Lock()
+_reload_lock = threading.Lock()
 
 # ───────────────────────────────────────────────────────────
 #  POMOCNICZE FUNKCJE
@@ -15,113 +50,159 @@ def _dec(val) -> Decimal:
     return Decimal(str(val)).quantize(Decimal("0.01"))
 
 
-def _slot_names(fact) -> list[str]:
-    return [s.name for s in fact.template.slots]
-
-
 # ───────────────────────────────────────────────────────────
-#  WPROWADZANIE FAKTÓW DO CLIPS
+#  PULA ŚRODOWISK CLIPS
 # ───────────────────────────────────────────────────────────
 
-def _push_facts(env: Environment, p: PayrollPayload) -> None:
-    env.assert_string(
-        f'(employee (first-name "{p.employee.firstName}") '
-        f'(last-name "{p.employee.lastName}") '
-        f'(contract-type {p.employee.contractType.value}) '
-        f'(is-student {"TRUE" if p.employee.isStudent else "FALSE"}))'
-    )
+def get_rules() -> RuleBase:
+    """Aktualna wersja reguł (wczytywana przy pierwszym użyciu)."""
+    global _rules
+    if _rules is None:
+        with _pool_lock:
+            if _rules is None:
+                _rules = RuleBase(RULES_FILE)
+    return _rules
 
-    env.assert_string(
-        f'(position (base-rate 6000) '
-        f'(currency {p.position.currency.value}) (fte 1))'
-    )
 
-    env.assert_string(
-        f'(period (start "{p.period.payPeriodStart}") '
-        f'(end "{p.period.payPeriodEnd}"))'
-    )
+def _new_environment() -> CompiledEnvironment:
+    return get_rules().new_environment()
 
-    ot = p.overtime
-    env.assert_string(
-        f'(overtime (fifty {ot.overtime50h}) (hundred {ot.overtime100h}) '
-        f'(night {ot.overtimeNightH}) '
-        f'(mult50 {ot.overtime50Multiplier}) '
-        f'(mult100 {ot.overtime100Multiplier}))'
-    )
 
-    tr = p.travel
-    env.assert_string(
-        f'(travel (dom-days {tr.travelDaysDomestic}) (abrd-days {tr.travelDaysAbroad}) '
-        f'(dom-rate {tr.dietRateDomestic}) (abrd-rate {tr.dietRateAbroad}) '
-        f'(accomodation {tr.accommodationCost}) (lump-sum {tr.lumpSumTransport}) '
-        f'(private-km {tr.privateCarKm}) (km-rate {tr.privateCarRatePerKm}))'
-    )
+def _is_healthy(env: CompiledEnvironment) -> bool:
+    return env.healthy()
 
-    al = p.allowances
-    env.assert_string(
-        f'(allowances (seniority-pct {al.seniorityBonusPct}) '
-        f'(function-allow {al.functionAllowance}) (perf-bonus {al.performanceBonus}) '
-        f'(regulation-bonus {al.regulationBonus}) (night-allow {al.nightWorkAllowance}) '
-        f'(weekend-allow {al.weekendHolidayAllowance}) (remote-allow {al.remoteWorkAllowance}) '
-        f'(medical {al.medicalBenefitValue}) (car {al.companyCarBenefitValue}))'
-    )
 
-    de = p.deductions
-    env.assert_string(
-        f'(deductions-pct '
-        f'(zus {de.employeeSocialInsurancePct if de.employeeSocialInsurancePct is not None else -1}) '
-        f'(health {de.healthInsurancePct if de.healthInsurancePct is not None else -1}) '
-        f'(ppk {de.ppkEmployeePct if de.ppkEmployeePct is not None else -1}) '
-        f'(bail {de.bailDeduction}))'
+def _build_pool(rules: RuleBase) -> EnginePool[CompiledEnvironment]:
+    return EnginePool(
+        rules.new_environment,
+        size=POOL_SIZE,
+        timeout=POOL_TIMEOUT,
+        health_check=_is_healthy,
+        prefill=False,
     )
 
-    ts = p.timesheet
-    env.assert_string(
-        f'(timesheet (hours-worked {ts.hoursWorked}) '
-        f'(norm-hours {ts.publicHolidaysInPeriod or 160}))'
-    )
+
+def get_pool() -> EnginePool[CompiledEnvironment]:
+    """
+    Zwraca (tworząc przy pierwszym użyciu) pulę środowisk CLIPS.
+    Środowiska powstają leniwie – `warm_up()` buduje je wszystkie od razu.
+    """
+    global _pool
+    if _pool is None:
+        rules = get_rules()
+        with _pool_lock:
+            if _pool is None:
+                _pool = _build_pool(rules)
+    return _pool
+
+
+def close_pool() -> None:
+    """Zamyka pulę (koniec aplikacji); kolejne `get_pool()` zbuduje nową."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def warm_up() -> int:
+    """Kompiluje obraz reguł i ładuje całą pulę. Zwraca liczbę nowych środowisk."""
+    get_rules().compile()
+    return get_pool().fill()
+
+
+@contextmanager
+def checkout() -> Iterator[CompiledEnvironment]:
+    """
+    Wypożycza środowisko z aktualnej puli. Jeśli pula zostanie podmieniona
+    w trakcie oczekiwania, wypożycza z nowej; obliczenie już trwające
+    kończy się na starym środowisku, które potem przepada.
+    """
+    pool = get_pool()
+    while True:
+        try:
+            env = pool.acquire()
+            break
+        except PoolClosed:
+            if get_pool() is pool:
+                raise
+            pool = get_pool()
+    try:
+        yield env
+    except BaseException:
+        pool.release(env, broken=True)
+        raise
+    else:
+        pool.release(env)
 
 
 # ───────────────────────────────────────────────────────────
-#  ZBIERANIE WYNIKÓW
+#  PRZEŁADOWANIE REGUŁ
 # ───────────────────────────────────────────────────────────
 
-def _collect_results(env: Environment) -> Dict[str, Dict[str, Decimal]]:
-    comp = ded = summ = contrib = None
-    for fact in env.facts():
-        name = fact.template.name
-        if name == "components":
-            comp = {s: _dec(fact[s]) for s in _slot_names(fact)}
-        elif name == "deductions":
-            ded = {s: _dec(fact[s]) for s in _slot_names(fact)}
-        elif name == "contributions":
-            contrib = {s: _dec(fact[s]) for s in _slot_names(fact)}
-        elif name == "summary":
-            summ = {"net": _dec(fact["net"])}
-    return {
-        "components": comp,
-        "deductions": ded,
-        "contributions": contrib,
-        "summary": summ,
-    }
+def reload_rules(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Wczytuje reguły od nowa (z `path` albo bieżącej ścieżki), buduje
+    i rozgrzewa nową pulę, a potem atomowo podmienia ją w miejsce starej.
+    Błąd w regułach zostawia działającą starą wersję.
+    """
+    global _rules, _pool
+    with _reload_lock:
+        started = time.perf_counter()
+        rules = RuleBase(path or get_rules().path)
+        rules.compile()
+        pool = _build_pool(rules)
+        pool.fill()
+        with _pool_lock:
+            old_rules, old_pool = _rules, _pool
+            _rules, _pool = rules, pool
+        if old_pool is not None:
+            old_pool.close()
+
+    info = {**rules.info(), "previous": old_rules.digest if old_rules else None,
+            "changed": old_rules is None or old_rules.digest != rules.digest,
+            "seconds": round(time.perf_counter() - started, 3)}
+    log.info("reguły przeładowane: %s", info)
+    return info
+
+
+class RulesWatcher(threading.Thread):
+    """Wątek, który przeładowuje reguły po zmianie pliku (PAYROLL_RULES_WATCH)."""
+
+    def __init__(self, interval: float = RULES_WATCH) -> None:
+        super().__init__(name="payroll-rules-watch", daemon=True)
+        self.interval = interval
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        fingerprint = RulesFingerprint(get_rules().path)
+        while not self._halt.wait(self.interval):
+            try:
+                if fingerprint() != get_rules().digest:
+                    reload_rules()
+            except Exception:  # noqa: BLE001
+                log.exception("przeładowanie reguł nie powiodło się – zostaje poprzednia wersja")
+
+    def stop(self) -> None:
+        self._halt.set()
 
 
 # ───────────────────────────────────────────────────────────
-#  GŁÓWNA FUNKCJA
+#  ZBIERANIE WYNIKÓW
 # ───────────────────────────────────────────────────────────
 
-def run_payroll(payload: PayrollPayload) -> PayrollResult:
-    env = _clips_env
-    env.reset()
-    _push_facts(env, payload)
-    env.run()
+def _decimals(values: Optional[Dict[str, Any]]) -> Optional[Dict[str, Decimal]]:
+    return None if values is None else {k: _dec(v) for k, v in values.items()}
 
-    facts = _collect_results(env)
 
-    comp = facts["components"]
-    contrib = facts["contributions"] or {"social": Decimal(0),
-                                         "health": Decimal(0),
-                                         "ppk": Decimal(0)}
+def _build_result(facts: Optional[Dict[str, Dict[str, Any]]]) -> PayrollResult:
+    if not facts or "components" not in facts or "summary" not in facts:
+        raise RuntimeError("silnik reguł nie wyznaczył wyniku dla tego obliczenia")
+
+    comp = _decimals(facts["components"])
+    contrib = _decimals(facts.get("contributions")) or {"social": Decimal(0),
+                                                        "health": Decimal(0),
+                                                        "ppk": Decimal(0)}
 
     details: Dict[str, Decimal] = {
         "baseSalary":       comp["base-salary"],
@@ -129,8 +210,8 @@ def run_payroll(payload: PayrollPayload) -> PayrollResult:
         "socialInsurance":  contrib["social"],
         "healthInsurance":  contrib["health"],
         "ppkContribution":  contrib["ppk"],
-        **(facts["deductions"] or {}),
-        "net":              facts["summary"]["net"],
+        **(_decimals(facts.get("deductions")) or {}),
+        "net":              _dec(facts["summary"]["net"]),
     }
 
     return PayrollResult(
@@ -139,4 +220,117 @@ def run_payroll(payload: PayrollPayload) -> PayrollResult:
         bonuses      = comp["allow-pay"],
         details      = details,
         calculatedAt = datetime.now(timezone.utc),
-    )
\ No newline at end of file
+    )
+
+
+# ───────────────────────────────────────────────────────────
+#  SESJA SILNIKA
+# ───────────────────────────────────────────────────────────
+
+def _run_session(
+    env: CompiledEnvironment, payloads: Sequence[PayrollPayload]
+) -> List[Union[PayrollResult, Exception]]:
+    """
+    Liczy wszystkie payloady w jednej sesji: jeden reset, jedno
+    uruchomienie agendy i jedno przejście po faktach. Obliczenie
+    identyfikuje pozycja na liście (calc-id), błędy są per pozycja.
+    """
+    with metrics.maybe_profile():
+        return _session(env, payloads)
+
+
+def _session(
+    env: CompiledEnvironment, payloads: Sequence[PayrollPayload]
+) -> List[Union[PayrollResult, Exception]]:
+    trace = metrics.current()
+
+    with metrics.stage("reset"):
+        env.env.reset()
+
+    failed: Dict[int, Exception] = {}
+    with metrics.stage("assert"):
+        for calc_id, payload in enumerate(payloads):
+            try:
+                env.assert_payload(payload, calc_id)
+            except Exception as ex:  # noqa: BLE001
+                failed[calc_id] = ex
+    metrics.annotate(calculations=len(payloads),
+                     facts=env.facts_per_payload * (len(payloads) - len(failed)))
+
+    try:
+        with metrics.stage("run"):
+            metrics.run_counted(env, trace)
+    except Exception:
+        if len(payloads) == 1:
+            raise
+        # błąd wykonania reguł – izolujemy winne obliczenie
+        out: List[Union[PayrollResult, Exception]] = []
+        for payload in payloads:
+            try:
+                out.extend(_session(env, [payload]))
+            except Exception as ex:  # noqa: BLE001
+                out.append(ex)
+        return out
+
+    with metrics.stage("collect"):
+        collected = env.collect()
+        results: List[Union[PayrollResult, Exception]] = []
+        for calc_id in range(len(payloads)):
+            if calc_id in failed:
+                results.append(failed[calc_id])
+                continue
+            try:
+                results.append(_build_result(collected.get(calc_id)))
+            except Exception as ex:  # noqa: BLE001
+                results.append(ex)
+    return results
+
+
+# ───────────────────────────────────────────────────────────
+#  GŁÓWNA FUNKCJA
+# ───────────────────────────────────────────────────────────
+
+def _resolve_engine(engine: Optional[str], rules: Optional[RuleBase] = None) -> str:
+    """
+    Silnik, który faktycznie policzy obliczenie. Silnik vector to kopia
+    reguł w Pythonie – gdy struktura bieżących reguł jest inna niż ta, którą
+    odwzorowuje (`RuleBase.mirrored`), liczy CLIPS.
+    """
+    engine = engine or ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"nieznany silnik obliczeń: {engine!r} (dostępne: {', '.join(ENGINES)})")
+    if engine == "vector" and not (rules or get_rules()).mirrored:
+        return "clips"
+    return engine
+
+
+def run_payroll(payload: PayrollPayload, engine: Optional[str] = None) -> PayrollResult:
+    if _resolve_engine(engine) == "vector":
+        result = run_payroll_batch([payload], engine="vector")[0]
+    else:
+        with checkout() as env:
+            result = _run_session(env, [payload])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def run_payroll_batch(
+    payloads: Sequence[PayrollPayload],
+    chunk_size: int = BATCH_CHUNK_SIZE,
+    engine: Optional[str] = None,
+) -> List[Union[PayrollResult, Exception]]:
+    """
+    Liczy listę payloadów, po `chunk_size` w jednej sesji silnika.
+    Zwraca wyniki w kolejności wejścia; nieudane pozycje to wyjątki.
+    """
+    rules = get_rules()
+    if _resolve_engine(engine, rules) == "vector":
+        from app.vector import run_payroll_vector
+        return run_payroll_vector(payloads, rules)
+
+    results: List[Union[PayrollResult, Exception]] = []
+    for start in range(0, len(payloads), chunk_size):
+        with checkout() as env:
+            results.extend(_run_session(env, payloads[start:start + chunk_size]))
+    return results
@@ -0,0 +1,60 @@
+"""
+Test różnicowy: te same losowe payloady przez silnik CLIPS i silnik
+kolumnowy, porównanie wyników co do grosza (bez `calculatedAt`).
+
+    python -m app.equivalence -n 5000 --seed 7
+"""
+import argparse
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from app.engine import get_rules, run_payroll_batch
+from app.synthetic import generate_payloads
+from app.vector import run_payroll_vector
+
+
+def compare(n: int, seed: int) -> List[Tuple[str, dict, dict]]:
+    """Zwraca listę rozbieżności `(calculationId, clips, vector)`."""
+    payloads = generate_payloads(n, seed)
+
+    started = time.perf_counter()
+    clips = run_payroll_batch(payloads, engine="clips")
+    t_clips = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # wprost, z pominięciem przełączenia na CLIPS przy niezgodnej strukturze reguł
+    vector = run_payroll_vector(payloads, get_rules())
+    t_vector = time.perf_counter() - started
+
+    print(f"clips: {t_clips:.3f} s, vector: {t_vector:.3f} s ({n} obliczeń)", file=sys.stderr)
+
+    mismatches = []
+    for payload, a, b in zip(payloads, clips, vector):
+        da = {"error": str(a)} if isinstance(a, Exception) else a.model_dump(exclude={"calculatedAt"})
+        db = {"error": str(b)} if isinstance(b, Exception) else b.model_dump(exclude={"calculatedAt"})
+        if da != db:
+            mismatches.append((payload.meta.calculationId, da, db))
+    return mismatches
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.equivalence",
+                                     description="Porównanie silnika CLIPS i kolumnowego.")
+    parser.add_argument("-n", type=int, default=2000, help="liczba losowych payloadów")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mismatches = compare(args.n, args.seed)
+    for calc_id, a, b in mismatches[:20]:
+        print(f"{calc_id}:\n  clips:  {a}\n  vector: {b}")
+    print(f"{len(mismatches)} rozbieżności na {args.n} obliczeń")
+    rules = get_rules()
+    if not rules.mirrored and not mismatches:
+        print(f"struktura reguł zgodna z app.vector – ustaw w app/rulebase.py\n"
+              f'MIRRORED_STRUCTURE = "{rules.structure}"')
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
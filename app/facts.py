@@ -0,0 +1,299 @@
+"""
+Prekompilowane odwzorowanie payloadu na fakty CLIPS i z powrotem.
+
+Szablony i listy slotów są pobierane raz, przy ładowaniu środowiska.
+Fakty są wstawiane przez FactBuilder (bez składania i parsowania
+tekstu – nazwiska z cudzysłowami nie psują już faktów), a wyniki są
+czytane wprost z czterech szablonów wynikowych.
+
+Wstawianie i odczyt idą przez C API CLIPS, bez obiektów `Fact` clipspy:
+w clipspy 1.0.x `Fact.__del__` woła `ReleaseFact` z błędną liczbą
+argumentów (wyjątek jest połykany), więc każdy taki obiekt na stałe
+blokuje swój fakt – pamięć środowiska rośnie, a `reset()`/`run()`
+zwalniają z każdą sesją.
+
+To wewnętrzne API clipspy – wersja jest przypięta w requirements.txt,
+a brak któregoś symbolu zatrzymuje import modułu z czytelnym błędem.
+"""
+from datetime import date
+from decimal import Decimal
+from enum import Enum
+from typing import (Annotated, Any, Callable, Dict, Iterable, List, Tuple, Type, Union,
+                    get_args, get_origin)
+
+import clips
+from clips import CLIPSError, Environment, Symbol
+from pydantic import BaseModel
+
+try:
+    from clips._clips import ffi, lib
+    from clips.common import environment_builder
+    from clips.values import clips_value, python_value
+except ImportError as ex:
+    raise ImportError(
+        f"clipspy {clips.__version__}: brak wewnętrznego API używanego przez app.facts "
+        f"({ex}); wymagana wersja jak w requirements.txt (clipspy==1.0.6)") from ex
+
+from app.schemas import (Allowances, Deductions, Employee, Overtime, PayrollPayload,
+                         Period, Position, TaxParameters, Timesheet, Travel)
+
+# funkcje C API CLIPS wołane wprost (FactBuilder, FactModifier, odczyt slotów)
+_C_API = ("FBSetDeftemplate", "FBPutSlot", "FBAssert", "FBError",
+          "CreateFactModifier", "FMPutSlot", "FMModify", "FMError", "FMDispose",
+          "FindDeftemplate", "GetNextFactInTemplate", "GetFactSlot", "Retract",
+          "PSE_NO_ERROR")
+_missing = [name for name in _C_API if not hasattr(lib, name)]
+if _missing:
+    raise ImportError(f"clipspy {clips.__version__}: brak symboli C API {', '.join(_missing)}; "
+                      f"wymagana wersja jak w requirements.txt (clipspy==1.0.6)")
+
+Converter = Callable[[Any], Any]
+
+_TRUE, _FALSE = Symbol("TRUE"), Symbol("FALSE")
+
+# brak stawki potrącenia → CLIPS wybiera stawkę domyślną
+_NO_PCT = -1
+
+# norma godzin, gdy payload nie podaje dni świątecznych (jak ?*HOURS_FULL_TIME*)
+_FULL_TIME_HOURS = 160
+
+
+# ───────────────────────────────────────────────────────────
+#  KONWERSJA WARTOŚCI
+# ───────────────────────────────────────────────────────────
+
+def _number(val: Any) -> Union[int, float]:
+    """Liczba tak, jak odczytałby ją lekser CLIPS z zapisu tekstowego."""
+    if isinstance(val, Decimal):
+        text = str(val)
+        return float(text) if ("." in text or "E" in text or "e" in text) else int(text)
+    return val
+
+
+def _pct(val: Any) -> Union[int, float]:
+    return _NO_PCT if val is None else _number(val)
+
+
+def _symbol(val: Enum) -> Symbol:
+    return Symbol(val.value)
+
+
+def _boolean(val: bool) -> Symbol:
+    return _TRUE if val else _FALSE
+
+
+def _norm_hours(val: int) -> int:
+    return val or _FULL_TIME_HOURS
+
+
+def _converter(model: Type[BaseModel], field: str) -> Converter:
+    """Dobiera konwersję na podstawie adnotacji pola w schemacie pydantic."""
+    annotation = model.model_fields[field].annotation
+    optional = get_origin(annotation) is Union and type(None) in get_args(annotation)
+    if optional:
+        annotation = next(a for a in get_args(annotation) if a is not type(None))
+    if get_origin(annotation) is Annotated:              # condecimal, conint…
+        annotation = get_args(annotation)[0]
+
+    if annotation is bool:
+        return _boolean
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return _symbol
+    if annotation in (Decimal, int, float):
+        return _pct if optional else _number
+    if annotation in (str, date):
+        return str
+    raise TypeError(f"brak konwersji CLIPS dla {model.__name__}.{field}: {annotation!r}")
+
+
+# ───────────────────────────────────────────────────────────
+#  TABLICE SLOTÓW
+# ───────────────────────────────────────────────────────────
+
+# szablon → (sekcja payloadu, model, [(slot, pole[, konwersja])], stałe sloty)
+_FACT_MAP: Dict[str, Tuple[str, Type[BaseModel], List[tuple], Dict[str, Any]]] = {
+    "employee": ("employee", Employee, [
+        ("first-name", "firstName"), ("last-name", "lastName"),
+        ("contract-type", "contractType"), ("is-student", "isStudent"),
+    ], {}),
+    "position": ("position", Position, [
+        ("currency", "currency"),
+    ], {"base-rate": 6000, "fte": 1}),
+    "period": ("period", Period, [
+        ("start", "payPeriodStart"), ("end", "payPeriodEnd"),
+    ], {}),
+    "overtime": ("overtime", Overtime, [
+        ("fifty", "overtime50h"), ("hundred", "overtime100h"),
+        ("night", "overtimeNightH"),
+        ("mult50", "overtime50Multiplier"), ("mult100", "overtime100Multiplier"),
+    ], {}),
+    "travel": ("travel", Travel, [
+        ("dom-days", "travelDaysDomestic"), ("abrd-days", "travelDaysAbroad"),
+        ("dom-rate", "dietRateDomestic"), ("abrd-rate", "dietRateAbroad"),
+        ("accomodation", "accommodationCost"), ("lump-sum", "lumpSumTransport"),
+        ("private-km", "privateCarKm"), ("km-rate", "privateCarRatePerKm"),
+    ], {}),
+    "allowances": ("allowances", Allowances, [
+        ("seniority-pct", "seniorityBonusPct"),
+        ("function-allow", "functionAllowance"), ("perf-bonus", "performanceBonus"),
+        ("regulation-bonus", "regulationBonus"), ("night-allow", "nightWorkAllowance"),
+        ("weekend-allow", "weekendHolidayAllowance"), ("remote-allow", "remoteWorkAllowance"),
+        ("medical", "medicalBenefitValue"), ("car", "companyCarBenefitValue"),
+    ], {}),
+    "deductions-pct": ("deductions", Deductions, [
+        ("zus", "employeeSocialInsurancePct"), ("health", "healthInsurancePct"),
+        ("ppk", "ppkEmployeePct"), ("bail", "bailDeduction"),
+    ], {}),
+    "timesheet": ("timesheet", Timesheet, [
+        ("hours-worked", "hoursWorked"),
+        ("norm-hours", "publicHolidaysInPeriod", _norm_hours),
+    ], {}),
+    "tax-ytd": ("tax", TaxParameters, [
+        ("gross", "ytdGross"),
+    ], {}),
+}
+
+# (szablon, sekcja, [(slot, pole, konwersja)], stałe sloty)
+SlotTable = Tuple[str, str, List[Tuple[str, str, Converter]], Dict[str, Any]]
+
+SLOT_TABLES: List[SlotTable] = [
+    (template, section,
+     [(slot, field, custom[0] if custom else _converter(model, field))
+      for slot, field, *custom in slots],
+     fixed)
+    for template, (section, model, slots, fixed) in _FACT_MAP.items()
+]
+
+OUTPUT_TEMPLATES = ("components", "deductions", "contributions", "summary")
+
+# Fakty wyprowadzane przez reguły. Reguły nie używają zależności logicznych,
+# więc po zmianie faktu wejściowego pochodne trzeba wycofać ręcznie –
+# inaczej `calc-base`/`calc-deductions` dopisałyby duplikaty, a `not
+# tax-advance` zablokowałoby przeliczenie zaliczki.
+_DERIVED = ("components", "tax-advance", "deductions", "contributions", "summary")
+
+DOWNSTREAM: Dict[str, Tuple[str, ...]] = {
+    "employee":       _DERIVED[1:],
+    "position":       _DERIVED,          # calc-base asertuje components od nowa
+    "period":         (),                # żadna reguła nie czyta okresu
+    "overtime":       _DERIVED[1:],      # components modyfikują same reguły
+    "travel":         _DERIVED[1:],
+    "allowances":     _DERIVED[1:],
+    "deductions-pct": _DERIVED[2:],
+    "timesheet":      _DERIVED,
+    "tax-ytd":        _DERIVED[1:],      # tylko zaliczka i to, co z niej wynika
+}
+
+
+# ───────────────────────────────────────────────────────────
+#  ŚRODOWISKO Z PREKOMPILOWANYM ODWZOROWANIEM
+# ───────────────────────────────────────────────────────────
+
+class CompiledEnvironment:
+    """Środowisko CLIPS z szablonami i listami slotów pobranymi przy ładowaniu."""
+
+    def __init__(self, env: Environment) -> None:
+        self.env = env
+        self._ptr = getattr(env, "_env", None)        # wskaźnik środowiska C
+        if self._ptr is None:
+            raise RuntimeError(f"clipspy {clips.__version__}: Environment bez atrybutu _env "
+                               f"(wymagana wersja jak w requirements.txt)")
+        self._builder = environment_builder(self._ptr, "fact")
+        self._inputs = []
+        for template, section, slots, fixed in SLOT_TABLES:
+            env.find_template(template)               # LookupError, gdy brak szablonu
+            self._inputs.append((
+                template.encode(), section,
+                [(slot.encode(), field, convert) for slot, field, convert in slots],
+                [(slot.encode(), value) for slot, value in fixed.items()],
+            ))
+        self.facts_per_payload = len(self._inputs)
+        self.sections = {section: idx for idx, (_, section, _, _) in enumerate(SLOT_TABLES)}
+        self.templates = [template for template, _, _, _ in SLOT_TABLES]
+        self._derived = {name: lib.FindDeftemplate(self._ptr, name.encode()) for name in _DERIVED}
+        self._outputs = []
+        for name in OUTPUT_TEMPLATES:
+            tpl = env.find_template(name)
+            slots = [s.name for s in tpl.slots if s.name != "calc-id"]
+            if name == "summary":
+                slots = ["net"]
+            self._outputs.append((name, lib.FindDeftemplate(self._ptr, name.encode()),
+                                  [(slot.encode(), slot) for slot in slots]))
+
+    def _put(self, slot: bytes, value: Any) -> None:
+        ret = lib.FBPutSlot(self._builder, slot, clips_value(self._ptr, value=value))
+        if ret != lib.PSE_NO_ERROR:
+            raise CLIPSError(self._ptr, f"slot {slot.decode()}: {value!r}", code=ret)
+
+    def assert_payload(self, p: PayrollPayload, calc_id: int) -> List[Any]:
+        """Wstawia fakty wejściowe; zwraca ich wskaźniki w kolejności `SLOT_TABLES`."""
+        builder = self._builder
+        facts = []
+        for template, section, slots, fixed in self._inputs:
+            model = getattr(p, section)
+            lib.FBSetDeftemplate(builder, template)
+            self._put(b"calc-id", calc_id)
+            for slot, value in fixed:
+                self._put(slot, value)
+            for slot, field, convert in slots:
+                self._put(slot, convert(getattr(model, field)))
+            fact = lib.FBAssert(builder)
+            if fact == ffi.NULL:
+                raise CLIPSError(self._ptr, code=lib.FBError(self._ptr))
+            facts.append(fact)
+        return facts
+
+    # ── zmiany przyrostowe (app.scenarios) ───────────────────
+
+    def slot_values(self, index: int, model: BaseModel) -> Dict[bytes, Any]:
+        """Wartości slotów faktu wejściowego `index` dla modelu sekcji."""
+        return {slot: convert(getattr(model, field))
+                for slot, field, convert in self._inputs[index][2]}
+
+    def modify(self, fact: Any, values: Dict[bytes, Any]) -> Any:
+        """`modify` tylko podanych slotów; zwraca wskaźnik zmienionego faktu."""
+        modifier = lib.CreateFactModifier(self._ptr, fact)
+        try:
+            for slot, value in values.items():
+                ret = lib.FMPutSlot(modifier, slot, clips_value(self._ptr, value=value))
+                if ret != lib.PSE_NO_ERROR:
+                    raise CLIPSError(self._ptr, f"slot {slot.decode()}: {value!r}", code=ret)
+            fact = lib.FMModify(modifier)
+            if fact == ffi.NULL:
+                raise CLIPSError(self._ptr, code=lib.FMError(self._ptr))
+            return fact
+        finally:
+            lib.FMDispose(modifier)
+
+    def retract_derived(self, templates: Iterable[str]) -> None:
+        """Wycofuje wszystkie fakty podanych szablonów pochodnych."""
+        for name in templates:
+            tpl, doomed = self._derived[name], []
+            fact = lib.GetNextFactInTemplate(tpl, ffi.NULL)
+            while fact != ffi.NULL:
+                doomed.append(fact)
+                fact = lib.GetNextFactInTemplate(tpl, fact)
+            for fact in doomed:
+                lib.Retract(fact)
+
+    def collect(self) -> Dict[int, Dict[str, Dict[str, Any]]]:
+        """Surowe wartości slotów wynikowych pogrupowane po calc-id."""
+        env, value = self._ptr, clips_value(self._ptr)
+        out: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        for name, tpl, slots in self._outputs:
+            fact = lib.GetNextFactInTemplate(tpl, ffi.NULL)
+            while fact != ffi.NULL:
+                lib.GetFactSlot(fact, b"calc-id", value)
+                row: Dict[str, Any] = {}
+                out.setdefault(python_value(env, value), {})[name] = row
+                for slot, key in slots:
+                    lib.GetFactSlot(fact, slot, value)
+                    row[key] = python_value(env, value)
+                fact = lib.GetNextFactInTemplate(tpl, fact)
+        return out
+
+    def healthy(self) -> bool:
+        try:
+            return self.env.find_template("summary") is not None
+        except LookupError:
+            return False
@@ -0,0 +1,371 @@
+"""
+Rejestr narastający (YTD): wyniki kolejnych okresów rozliczeniowych
+pracownika w roku podatkowym, w SQLite.
+
+Próg podatkowy (`?*TAX_HI_THRESHOLD*`) dotyczy przychodu od początku roku,
+więc okres nie jest liczony w izolacji: `record` uzupełnia w payloadzie
+`tax.ytdGross` sumą brutto wcześniejszych okresów z rejestru, liczy
+i zapisuje okres. Zmiana wcześniejszego okresu przesuwa przychód
+narastający okresów późniejszych – przeliczane są tylko te, których
+`ytd_before` faktycznie się zmienił (brutto od niego nie zależy, więc
+zmiana samych potrąceń nie rusza niczego dalej).
+
+Przeliczenie całego roku (`recompute_year`, np. po zmianie reguł) idzie
+blokami pracowników, a w bloku falami: fala k to k-ty okres wszystkich
+pracowników bloku naraz, liczony jedną partią (`run_payroll_batch`)
+i zapisany jedną transakcją.
+
+    python -m app.ledger okresy.json              # zapis okresów
+    python -m app.ledger --recompute 2025 --engine vector
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import (Any, Callable, Dict, Generator, Iterable, List, Optional, Sequence,
+                    Tuple, Union)
+
+from pydantic import ValidationError
+
+from app.engine import get_rules, run_payroll_batch
+from app.schemas import LedgerPeriod, PayrollPayload, PayrollResult
+
+# dane osobowe i wynagrodzenia → katalog danych usługi (0700), plik 0600
+LEDGER_PATH = os.getenv("PAYROLL_LEDGER_PATH", os.path.join(
+    os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "payroll", "ytd-ledger.sqlite3"))
+LEDGER_ENGINE = os.getenv("PAYROLL_LEDGER_ENGINE")        # None → PAYROLL_ENGINE
+# liczba pracowników w jednym bloku przeliczenia roku (SQLite IN ≤ 32766 parametrów)
+RECOMPUTE_BLOCK = int(os.getenv("PAYROLL_LEDGER_BLOCK", "5000"))
+
+Runner = Callable[[Sequence[PayrollPayload], Optional[str]],
+                  List[Union[PayrollResult, Exception]]]
+
+_ledger: Optional["YtdLedger"] = None
+_ledger_lock = threading.Lock()
+
+_NO_YTD = {"tax": {"ytdGross"}}
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS ytd_ledger ("
+    " employee TEXT NOT NULL, tax_year INTEGER NOT NULL,"
+    " period TEXT NOT NULL,"                 # payPeriodStart (ISO)
+    " ytd_before TEXT NOT NULL,"             # brutto narastająco przed okresem
+    " gross TEXT NOT NULL, tax_adv TEXT NOT NULL, net TEXT NOT NULL,"
+    " rules TEXT NOT NULL,"
+    " payload TEXT NOT NULL,"                # wejście okresu (bez tax.ytdGross)
+    " result TEXT NOT NULL,"
+    " PRIMARY KEY (employee, tax_year, period))",
+    "CREATE INDEX IF NOT EXISTS ytd_ledger_year ON ytd_ledger (tax_year, employee, period)",
+)
+
+
+def _run_batch(payloads: Sequence[PayrollPayload],
+               engine: Optional[str]) -> List[Union[PayrollResult, Exception]]:
+    return run_payroll_batch(payloads, engine=engine)
+
+
+def employee_key(payload: PayrollPayload) -> str:
+    """
+    `employee.employeeId` – wymagany: imię i nazwisko nie identyfikują
+    pracownika, a wspólny klucz zsumowałby przychody dwóch osób.
+    """
+    if not payload.employee.employeeId:
+        raise ValueError("rejestr YTD wymaga employee.employeeId")
+    return payload.employee.employeeId
+
+
+def _open_private(path: str) -> None:
+    """Katalog 0700 i plik bazy 0600 (WAL/SHM SQLite dziedziczą prawa pliku)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+
+
+def with_ytd(payload: PayrollPayload, ytd: Decimal) -> PayrollPayload:
+    return payload.model_copy(update={"tax": payload.tax.model_copy(update={"ytdGross": ytd})})
+
+
+# ───────────────────────────────────────────────────────────
+#  RAPORT
+# ───────────────────────────────────────────────────────────
+
+@dataclass
+class LedgerReport:
+    # wyniki w kolejności wejścia `record` (dla `recompute_year` puste)
+    results: List[Union[PayrollResult, Exception, None]] = field(default_factory=list)
+    computed: int = 0          # okresy przeliczone silnikiem
+    reused: int = 0            # okresy bez zmian (ytd_before ten sam)
+    failed: int = 0
+    waves: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {"computed": self.computed, "reused": self.reused, "failed": self.failed,
+                "waves": self.waves, "elapsed": round(self.elapsed, 3)}
+
+
+@dataclass
+class _Stored:
+    period: str
+    ytd_before: Decimal
+    gross: Decimal
+    payload: str
+
+
+# ───────────────────────────────────────────────────────────
+#  REJESTR
+# ───────────────────────────────────────────────────────────
+
+# (pozycja na wejściu, payload) dla nowych okresów, kluczowane okresem
+Incoming = Dict[str, Tuple[int, PayrollPayload]]
+Walk = Generator[PayrollPayload, Union[PayrollResult, Exception], None]
+
+
+class YtdLedger:
+    def __init__(
+        self,
+        path: str = LEDGER_PATH,
+        engine: Optional[str] = LEDGER_ENGINE,
+        runner: Runner = _run_batch,
+    ) -> None:
+        self.path = path
+        self.engine = engine
+        self.runner = runner
+        # jedno przeliczenie naraz: odczyt historii i zapis wyników muszą
+        # widzieć ten sam stan rejestru
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            _open_private(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    # ── odczyt ───────────────────────────────────────────────
+
+    def history(self, employee: str, tax_year: int) -> List[LedgerPeriod]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT period, ytd_before, gross, tax_adv, net FROM ytd_ledger"
+                " WHERE employee = ? AND tax_year = ? ORDER BY period",
+                (employee, tax_year),
+            ).fetchall()
+        return [LedgerPeriod(period=period, ytdBefore=Decimal(ytd), gross=Decimal(gross),
+                             taxAdvance=Decimal(tax_adv), net=Decimal(net))
+                for period, ytd, gross, tax_adv, net in rows]
+
+    def _stored(self, employee: str, tax_year: int) -> List[_Stored]:
+        rows = self._db.execute(
+            "SELECT period, ytd_before, gross, payload FROM ytd_ledger"
+            " WHERE employee = ? AND tax_year = ? ORDER BY period",
+            (employee, tax_year),
+        ).fetchall()
+        return [_Stored(period, Decimal(ytd), Decimal(gross), payload)
+                for period, ytd, gross, payload in rows]
+
+    # ── przeliczanie ─────────────────────────────────────────
+
+    def _walk(self, employee: str, tax_year: int, stored: List[_Stored],
+              incoming: Incoming, force: bool, report: LedgerReport,
+              writes: List[tuple]) -> Walk:
+        """
+        Przechodzi okresy jednego pracownika w kolejności; każdy okres do
+        przeliczenia oddaje (`yield`) jako payload z `ytdGross` i dostaje
+        z powrotem wynik. Okres zapisany, którego `ytd_before` się nie zmienił,
+        jest pomijany (chyba że `force`).
+        """
+        ytd = Decimal(0)
+        rules = get_rules().digest
+        old_by_period = {row.period: row for row in stored}
+        for period in sorted(old_by_period.keys() | incoming.keys()):
+            old, new = old_by_period.get(period), incoming.get(period)
+            if new is None and not force and old.ytd_before == ytd:
+                report.reused += 1
+                ytd += old.gross
+                continue
+
+            payload = new[1] if new is not None else PayrollPayload.model_validate_json(old.payload)
+            result = yield with_ytd(payload, ytd)
+            if new is not None:
+                report.results[new[0]] = result
+            if isinstance(result, Exception):
+                report.failed += 1
+                if old is not None:            # w rejestrze zostaje poprzedni wynik
+                    ytd += old.gross
+                continue
+
+            writes.append((str(ytd), str(result.gross), str(result.details["tax-adv"]),
+                           str(result.details["net"]), rules, result.model_dump_json(),
+                           employee, tax_year, period,
+                           # wejście zapisywane tylko dla nowych/poprawionych okresów
+                           payload.model_dump_json(exclude=_NO_YTD) if new is not None else None))
+            ytd += result.gross
+
+    def _drive(self, walks: Iterable[Walk], report: LedgerReport, writes: List[tuple]) -> None:
+        """Fala = bieżący okres każdego pracownika, jedna partia silnika."""
+        pending: List[Tuple[Walk, PayrollPayload]] = []
+        for walk in walks:
+            try:
+                pending.append((walk, next(walk)))
+            except StopIteration:
+                pass
+        while pending:
+            report.waves += 1
+            report.computed += len(pending)
+            results = self.runner([payload for _, payload in pending], self.engine)
+            following = []
+            for (walk, _), result in zip(pending, results):
+                try:
+                    following.append((walk, walk.send(result)))
+                except StopIteration:
+                    pass
+            pending = following
+            self._write(writes)
+
+    def _write(self, writes: List[tuple]) -> None:
+        if not writes:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO ytd_ledger (ytd_before, gross, tax_adv, net, rules,"
+                " result, employee, tax_year, period, payload)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in writes if row[-1] is not None])
+            self._db.executemany(
+                "UPDATE ytd_ledger SET ytd_before = ?, gross = ?, tax_adv = ?, net = ?,"
+                " rules = ?, result = ? WHERE employee = ? AND tax_year = ? AND period = ?",
+                [row[:-1] for row in writes if row[-1] is None])
+        writes.clear()
+
+    # ── API ──────────────────────────────────────────────────
+
+    def record(self, payloads: Sequence[PayrollPayload]) -> LedgerReport:
+        """
+        Liczy i zapisuje okresy (nowe albo poprawione) z przychodem
+        narastającym z rejestru; przelicza późniejsze okresy, których
+        przychód narastający się przez to zmienił.
+        """
+        started = time.perf_counter()
+        report = LedgerReport(results=[None] * len(payloads))
+        groups: Dict[Tuple[str, int], Incoming] = {}
+        for idx, payload in enumerate(payloads):
+            try:
+                employee = employee_key(payload)
+            except ValueError as ex:
+                report.results[idx] = ex
+                continue
+            incoming = groups.setdefault((employee, payload.tax.taxYear), {})
+            period = payload.period.payPeriodStart.isoformat()
+            if period in incoming:
+                report.results[idx] = ValueError(f"zduplikowany okres {period}")
+                continue
+            incoming[period] = (idx, payload)
+
+        writes: List[tuple] = []
+        with self._lock:
+            walks = [self._walk(employee, year, self._stored(employee, year),
+                                incoming, False, report, writes)
+                     for (employee, year), incoming in groups.items()]
+            self._drive(walks, report, writes)
+        report.elapsed = time.perf_counter() - started
+        return report
+
+    def recompute_year(self, tax_year: int, employees: Optional[Sequence[str]] = None,
+                       block: int = RECOMPUTE_BLOCK) -> LedgerReport:
+        """
+        Przelicza od nowa wszystkie zapisane okresy roku (albo wybranych
+        pracowników) – blokami po `block` pracowników, żeby w pamięci nie
+        było naraz całego roku.
+        """
+        started = time.perf_counter()
+        report = LedgerReport()
+        writes: List[tuple] = []
+        with self._lock:
+            if employees is None:
+                employees = [employee for employee, in self._db.execute(
+                    "SELECT DISTINCT employee FROM ytd_ledger WHERE tax_year = ? ORDER BY employee",
+                    (tax_year,))]
+            for start in range(0, len(employees), block):
+                chunk = list(employees[start:start + block])
+                rows = self._db.execute(
+                    "SELECT employee, period, ytd_before, gross, payload FROM ytd_ledger"
+                    f" WHERE tax_year = ? AND employee IN ({', '.join('?' * len(chunk))})"
+                    " ORDER BY employee, period", [tax_year, *chunk]).fetchall()
+                walks = [self._walk(employee, tax_year,
+                                    [_Stored(period, Decimal(ytd), Decimal(gross), payload)
+                                     for _, period, ytd, gross, payload in group],
+                                    {}, True, report, writes)
+                         for employee, group in itertools.groupby(rows, key=lambda row: row[0])]
+                self._drive(walks, report, writes)
+        report.elapsed = time.perf_counter() - started
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows, employees, years = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT employee), COUNT(DISTINCT tax_year)"
+                " FROM ytd_ledger").fetchone()
+        return {"path": self.path, "periods": rows, "employees": employees, "taxYears": years}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def get_ledger() -> YtdLedger:
+    """Wspólny rejestr procesu (PAYROLL_LEDGER_PATH)."""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = YtdLedger()
+    return _ledger
+
+
+# ───────────────────────────────────────────────────────────
+#  CLI
+# ───────────────────────────────────────────────────────────
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.ledger",
+                                     description="Rejestr narastający (YTD) okresów płacowych.")
+    parser.add_argument("input", nargs="?", help="JSON z listą payloadów do zapisania")
+    parser.add_argument("--recompute", type=int, metavar="ROK",
+                        help="przelicz od nowa wszystkie okresy roku podatkowego")
+    parser.add_argument("--db", default=LEDGER_PATH, help="plik SQLite rejestru")
+    parser.add_argument("--engine", choices=["clips", "vector"], default=LEDGER_ENGINE)
+    args = parser.parse_args(argv)
+    if args.input is None and args.recompute is None:
+        parser.error("podaj plik z payloadami albo --recompute ROK")
+
+    ledger = YtdLedger(args.db, engine=args.engine)
+    if args.input is not None:
+        with open(args.input, "rb") as fh:
+            items = json.load(fh)
+        payloads: List[PayrollPayload] = []
+        for idx, item in enumerate(items):
+            try:
+                payloads.append(PayrollPayload.model_validate(item))
+            except ValidationError as ex:
+                print(f"#{idx}: {ex}", file=sys.stderr)
+        report = ledger.record(payloads)
+        print(json.dumps({"recorded": report.summary()}))
+    if args.recompute is not None:
+        report = ledger.recompute_year(args.recompute)
+        print(json.dumps({"recomputed": report.summary()}))
+    ledger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,47 @@
-from fastapi import FastAPI, HTTPException
+import hmac
+import os
+from contextlib import asynccontextmanager
+
+from typing import Any, Dict, List, Literal, Optional, Sequence, Tuple
+
+from clips import CLIPSError
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+
+from app.schemas import (LedgerHistory, PayrollBatchResult, PayrollPayload, PayrollResult,
+                         ScenarioRequest, ScenarioTable)
+from app.cache import get_cache, run_payroll_batch_cached, run_payroll_cached
+from app.batcher import MICROBATCH, BatcherClosed, MicroBatcher, QueueFull, QueueTimeout
+from app.engine import (RULES_WATCH, WARMUP, RulesWatcher, close_pool, get_pool,
+                        get_rules, reload_rules, warm_up)
+from app.ledger import get_ledger
+from app.pool import PoolTimeout
+from app.scenarios import run_scenarios
+from app.stream import NDJSONStreamingResponse, aiter_ndjson
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP:
+        warm_up()       # obraz reguł i wszystkie środowiska gotowe przed pierwszym żądaniem
+    watcher = RulesWatcher() if RULES_WATCH > 0 else None
+    if watcher is not None:
+        watcher.start()
+    app.state.batcher = MicroBatcher() if MICROBATCH else None
+    if app.state.batcher is not None:
+        await app.state.batcher.start()
+    yield
+    if app.state.batcher is not None:
+        await app.state.batcher.stop()
+    if watcher is not None:
+        watcher.stop()
+    close_pool()
 
-from app.schemas import PayrollPayload, PayrollResult
-from app.engine import run_payroll
 
 # ──────────────────────────────────────────────────────────────────
 #  Inicjalizacja FastAPI
@@ -11,7 +50,8 @@ app = FastAPI(
     title="Payroll-CLIPS PoC",
     version="0.1.0",
     description="Prosty serwer HTTP demonstrujący kalkulator "
-                "wynagrodzeń z użyciem silnika reguł CLIPS."
+                "wynagrodzeń z użyciem silnika reguł CLIPS.",
+    lifespan=lifespan,
 )
 
 # ──────────────────────────────────────────────────────────────────
@@ -27,21 +67,279 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ──────────────────────────────────────────────────────────────────
+#  Endpointy administracyjne (/admin/*) – tylko z tokenem
+# ──────────────────────────────────────────────────────────────────
+ADMIN_TOKEN = os.getenv("PAYROLL_ADMIN_TOKEN")     # brak → /admin/* wyłączone
+
+
+def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    """Wymaga nagłówka `Authorization: Bearer <PAYROLL_ADMIN_TOKEN>`."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403,
+                            detail="endpointy administracyjne wyłączone (PAYROLL_ADMIN_TOKEN)")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="nieprawidłowy token administracyjny",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+# ──────────────────────────────────────────────────────────────────
+#  Instrumentacja (PAYROLL_METRICS=0 wyłącza)
+# ──────────────────────────────────────────────────────────────────
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # ──────────────────────────────────────────────────────────────────
 #  Endpoint HTTP
 # ──────────────────────────────────────────────────────────────────
 @app.post("/calculate", response_model=PayrollResult, tags=["Payroll"])
-def calculate(req: PayrollPayload):
+@metrics.instrumented
+async def calculate(
+    req: PayrollPayload,
+    request: Request,
+    engine: Optional[Literal["clips", "vector"]] = None,
+):
     """
     Przyjmuje payload z danymi płacowymi i zwraca wynik obliczeń
     (brutto, dodatki, potrącenia, netto).
+
+    Współbieżne żądania są łączone w mikro-partie liczone w jednej sesji
+    silnika; przy pełnej kolejce lub zbyt długim oczekiwaniu → 429.
     """
+    metrics.annotate(calculation_id=req.meta.calculationId)
+    batcher: Optional[MicroBatcher] = getattr(request.app.state, "batcher", None)
     try:
-        return run_payroll(req)
+        if batcher is None:
+            return await run_in_threadpool(run_payroll_cached, req, engine)
+        return await batcher.submit(req, engine)
+    except (QueueFull, QueueTimeout) as ex:
+        raise HTTPException(status_code=429, detail=str(ex),
+                            headers={"Retry-After": "1"}) from ex
+    except (PoolTimeout, BatcherClosed) as ex:
+        raise HTTPException(status_code=503, detail=str(ex)) from ex
     except Exception as ex:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=str(ex)) from ex
 
 
+def _parse_items(
+    items: List[Dict[str, Any]],
+) -> Tuple[PayrollBatchResult, List[str], List[PayrollPayload]]:
+    """
+    Waliduje pozycje partii. Klucz to `meta.calculationId` (albo `#indeks`);
+    duplikaty i błędy walidacji od razu trafiają do `errors`.
+    """
+    out = PayrollBatchResult()
+    keys: List[str] = []
+    seen: set[str] = set()
+    payloads: List[PayrollPayload] = []
+
+    for idx, item in enumerate(items):
+        meta = item.get("meta")
+        calc_id = meta.get("calculationId") if isinstance(meta, dict) else None
+        key = str(calc_id) if calc_id is not None else f"#{idx}"
+        if key in seen:
+            out.errors[f"{key}#{idx}"] = "zduplikowany meta.calculationId"
+            continue
+        seen.add(key)
+        try:
+            payloads.append(PayrollPayload.model_validate(item))
+        except ValidationError as ex:
+            out.errors[key] = str(ex)
+            continue
+        keys.append(key)
+    return out, keys, payloads
+
+
+def _merge_results(
+    out: PayrollBatchResult, keys: List[str], results: Sequence[Any],
+) -> PayrollBatchResult:
+    for key, res in zip(keys, results):
+        if isinstance(res, Exception):
+            out.errors[key] = str(res)
+        else:
+            out.results[key] = res
+    return out
+
+
+@app.post("/calculate/batch", response_model=PayrollBatchResult, tags=["Payroll"])
+@metrics.instrumented
+def calculate_batch(
+    items: List[Dict[str, Any]],
+    engine: Optional[Literal["clips", "vector"]] = None,
+):
+    """
+    Przyjmuje listę payloadów i liczy je wsadowo (wiele obliczeń w jednej
+    sesji silnika). Wyniki i błędy są kluczowane `meta.calculationId`;
+    błąd jednej pozycji nie przerywa całej partii. Parametr `engine`
+    wybiera silnik: reguły CLIPS albo kolumnowy odpowiednik NumPy.
+    """
+    out, keys, payloads = _parse_items(items)
+    try:
+        results = run_payroll_batch_cached(payloads, engine=engine)
+    except PoolTimeout as ex:
+        raise HTTPException(status_code=503, detail=str(ex)) from ex
+    return _merge_results(out, keys, results)
+
+
+@app.post("/calculate/scenarios", response_model=ScenarioTable, tags=["Payroll"])
+@metrics.instrumented
+def calculate_scenarios(req: ScenarioRequest):
+    """
+    Analiza „co jeśli”: payload bazowy plus lista zmian (`deltas`) i/lub
+    siatka parametrów (`grid`, np. {"overtime.overtime50h": [0, 10, 20]}).
+    Baza jest liczona raz, warianty przyrostowo w tym samym środowisku.
+    Wynik to zwarta tabela: wartości parametrów + kolumny wypłaty.
+    """
+    try:
+        return run_scenarios(req.base, deltas=req.deltas, grid=req.grid)
+    except ValueError as ex:
+        raise HTTPException(status_code=422, detail=str(ex)) from ex
+    except PoolTimeout as ex:
+        raise HTTPException(status_code=503, detail=str(ex)) from ex
+
+
+@app.post("/ledger/periods", response_model=PayrollBatchResult, tags=["Ledger"])
+@metrics.instrumented
+def ledger_record(items: List[Dict[str, Any]]):
+    """
+    Zapisuje okresy w rejestrze narastającym (YTD): każdy liczony jest
+    z przychodem od początku roku z wcześniejszych okresów pracownika
+    (`employee.employeeId` – wymagany, bez niego pozycja trafia do błędów).
+    Poprawka wcześniejszego okresu przelicza późniejsze okresy, na które
+    wpływa. Klucze jak w `/calculate/batch`.
+    """
+    out, keys, payloads = _parse_items(items)
+    try:
+        report = get_ledger().record(payloads)
+    except PoolTimeout as ex:
+        raise HTTPException(status_code=503, detail=str(ex)) from ex
+    return _merge_results(out, keys, report.results)
+
+
+@app.get("/ledger/{tax_year}/{employee}", response_model=LedgerHistory, tags=["Ledger"])
+def ledger_history(tax_year: int, employee: str):
+    """Okresy pracownika w roku: przychód narastający przed okresem, brutto, zaliczka, netto."""
+    periods = get_ledger().history(employee, tax_year)
+    if not periods:
+        raise HTTPException(status_code=404, detail="brak okresów w rejestrze")
+    return LedgerHistory(employee=employee, taxYear=tax_year, periods=periods)
+
+
+@app.post("/admin/ledger/{tax_year}/recompute", tags=["Admin"],
+          dependencies=[Depends(require_admin)])
+def ledger_recompute(tax_year: int):
+    """
+    Przelicza od nowa wszystkie zapisane okresy roku (np. po zmianie reguł).
+    Przez cały czas blokuje rejestr, więc wymaga tokenu administracyjnego.
+    """
+    try:
+        return get_ledger().recompute_year(tax_year).summary()
+    except PoolTimeout as ex:
+        raise HTTPException(status_code=503, detail=str(ex)) from ex
+
+
+@app.post("/calculate/stream", tags=["Payroll"])
+async def calculate_stream(request: Request):
+    """
+    Przyjmuje NDJSON (jeden payload na linię) i odsyła strumieniowo NDJSON
+    z wynikami w kolejności wejścia, w miarę ich wyliczania.
+    """
+    return NDJSONStreamingResponse(aiter_ndjson(request.stream()))
+
+
+@app.get("/health/pool", tags=["Diagnostics"])
+def pool_metrics():
+    """
+    Stan puli środowisk CLIPS: zajęte / wolne środowiska, oczekujący,
+    czasy oczekiwania na wypożyczenie i liczba wymian po błędach.
+    """
+    return get_pool().metrics()
+
+
+@app.get("/health/batcher", tags=["Diagnostics"])
+def batcher_metrics(request: Request):
+    """
+    Stan mikro-partii: długość kolejki, partie w locie, średni i największy
+    rozmiar partii, żądania odrzucone (pełna kolejka) i przeterminowane.
+    """
+    batcher = getattr(request.app.state, "batcher", None)
+    return batcher.metrics() if batcher is not None else {"enabled": False}
+
+
+@app.get("/health/rules", tags=["Diagnostics"])
+def rules_info():
+    """Aktualna wersja reguł: ścieżka, SHA-256 treści i plik obrazu binarnego."""
+    return get_rules().info()
+
+
+@app.post("/admin/rules/reload", tags=["Admin"],
+          dependencies=[Depends(require_admin)])
+def rules_reload():
+    """
+    Przeładowuje `payroll.clp` bez restartu: nowa pula powstaje w tle,
+    po czym zastępuje starą; trwające obliczenia kończą się na starej.
+    Błąd w regułach → 422, dotychczasowe reguły działają dalej.
+    Wymaga tokenu administracyjnego (`PAYROLL_ADMIN_TOKEN`).
+    """
+    try:
+        return reload_rules()
+    except (CLIPSError, LookupError, OSError) as ex:
+        raise HTTPException(status_code=422, detail=str(ex)) from ex
+
+
+@app.get("/health/ledger", tags=["Diagnostics"])
+def ledger_stats():
+    """Rejestr YTD: plik bazy, liczba zapisanych okresów, pracowników i lat podatkowych."""
+    return get_ledger().stats()
+
+
+@app.get("/health/cache", tags=["Diagnostics"])
+def cache_metrics():
+    """
+    Stan pamięci podręcznej wyników: liczba wpisów i bajtów, trafienia,
+    chybienia, usunięcia oraz odcisk bieżącego pliku reguł.
+    """
+    cache = get_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Diagnostics"])
+def prometheus_metrics(request: Request):
+    """
+    Metryki w formacie tekstowym Prometheus: histogramy czasu żądań
+    i etapów obliczenia, odpalenia reguł, fakty, stan puli i cache.
+    """
+    pool = get_pool().metrics()
+    extra = {
+        "payroll_pool_size": pool["size"],
+        "payroll_pool_in_use": pool["inUse"],
+        "payroll_pool_waiters": pool["waiters"],
+        "payroll_pool_wait_seconds_total": pool["waitTimeTotal"],
+        "payroll_pool_timeouts_total": pool["timeouts"],
+    }
+    batcher = getattr(request.app.state, "batcher", None)
+    if batcher is not None:
+        stats = batcher.metrics()
+        extra.update({
+            "payroll_microbatch_queued": stats["queued"],
+            "payroll_microbatch_in_flight": stats["inFlight"],
+            "payroll_microbatch_batches_total": stats["batches"],
+            "payroll_microbatch_rejected_total": stats["rejected"],
+            "payroll_microbatch_expired_total": stats["expired"],
+        })
+    cache = get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        extra.update({
+            "payroll_cache_entries": stats["entries"],
+            "payroll_cache_hits_total": stats["hits"],
+            "payroll_cache_misses_total": stats["misses"],
+        })
+    return PlainTextResponse(metrics.registry.render(extra),
+                             media_type="text/plain; version=0.0.4")
+
+
 # ──────────────────────────────────────────────────────────────────
 #  Ułatwienie do lokalnego uruchamiania `python -m app.main`
 # ──────────────────────────────────────────────────────────────────
@@ -0,0 +1,425 @@
+"""
+Instrumentacja ścieżki obliczeń i eksport metryk w formacie Prometheus.
+
+Każde żądanie `/calculate*` dostaje ślad (`Trace`) z czasami etapów:
+
+    validation   – od przyjęcia żądania do wejścia w endpoint
+                   (odczyt treści, JSON, walidacja pydantic, przejście do wątku)
+    queue        – oczekiwanie w kolejce mikro-partii (app.batcher)
+    reset, assert, run, collect – sesja silnika CLIPS
+    serialization – od wyjścia z endpointu do wysłania nagłówków odpowiedzi
+
+oraz licznikami odpaleń reguł i wstawionych faktów. Łączna liczba odpaleń
+pochodzi wprost z `env.run()`; rozbicie na reguły (nazwy z `payroll.clp`)
+i ich czasy daje `(watch rules)` przechwycone routerem – to kosztuje
+ok. 70% czasu sesji, więc obejmuje tylko ułamek PAYROLL_RULE_SAMPLE sesji.
+Wolne żądania są logowane z identyfikatorem obliczenia i rozbiciem na
+etapy; wybrany ułamek sesji silnika można profilować cProfile.
+
+Przy PAYROLL_METRICS=0 middleware nie jest instalowany, a silnik widzi
+tylko pusty ślad (jedno odczytanie ContextVar na etap).
+"""
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from clips import Environment
+from clips.routers import Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ENABLED = os.getenv("PAYROLL_METRICS", "1").lower() not in ("0", "false", "no")
+SLOW_MS = float(os.getenv("PAYROLL_SLOW_MS", "0"))                   # 0 → log wyłączony
+PROFILE_RATE = float(os.getenv("PAYROLL_PROFILE_RATE", "0"))         # np. 0.01 = 1% sesji
+RULE_SAMPLE = float(os.getenv("PAYROLL_RULE_SAMPLE", "0.05"))        # sesje z rozbiciem na reguły
+PROFILE_DIR = os.getenv("PAYROLL_PROFILE_DIR", os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "payroll-profiles"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STAGES = ("validation", "queue", "reset", "assert", "run", "collect", "serialization")
+
+log = logging.getLogger("app.metrics")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("payroll_trace", default=None)
+_NULL = nullcontext()
+
+
+# ───────────────────────────────────────────────────────────
+#  METRYKI
+# ───────────────────────────────────────────────────────────
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Registry:
+    """Zbiorcze metryki procesu (bezpieczne wątkowo)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, int], int] = Counter()
+        self.latency: Dict[str, Histogram] = {}
+        self.stages: Dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+        self.fired = 0
+        self.rules_fired: Dict[str, int] = Counter()
+        self.rule_seconds: Dict[str, float] = Counter()
+        self.rule_sessions = 0
+        self.facts_asserted = 0
+        self.calculations = 0
+        self.slow_requests = 0
+        self.profiles = 0
+
+    def record(self, path: str, status: int, total: float, trace: "Trace") -> None:
+        with self._lock:
+            self.requests[(path, status)] += 1
+            self.latency.setdefault(path, Histogram()).observe(total)
+            for stage, seconds in trace.stages.items():
+                self.stages[stage].observe(seconds)
+            self.slow_requests += trace.slow
+            self._count(trace)
+
+    def absorb(self, trace: "Trace") -> None:
+        """Liczniki śladu bez żądania HTTP (np. wspólnej sesji mikro-partii)."""
+        with self._lock:
+            self._count(trace)
+
+    def _count(self, trace: "Trace") -> None:
+        self.fired += trace.fired
+        self.rules_fired.update(trace.rules)
+        self.rule_seconds.update(trace.rule_seconds)
+        self.rule_sessions += trace.rule_sessions
+        self.facts_asserted += trace.facts
+        self.calculations += trace.calculations
+
+    def render(self, extra: Optional[Dict[str, float]] = None) -> str:
+        out: List[str] = []
+        with self._lock:
+            out += ["# HELP payroll_requests_total Żądania HTTP obliczeń.",
+                    "# TYPE payroll_requests_total counter"]
+            for (path, status), n in sorted(self.requests.items()):
+                out.append(f'payroll_requests_total{{path="{path}",status="{status}"}} {n}')
+
+            out += ["# HELP payroll_request_duration_seconds Czas obsługi żądania.",
+                    "# TYPE payroll_request_duration_seconds histogram"]
+            for path, hist in sorted(self.latency.items()):
+                out += hist.render("payroll_request_duration_seconds", f'path="{path}"')
+
+            out += ["# HELP payroll_stage_duration_seconds Czas etapu obliczenia na żądanie.",
+                    "# TYPE payroll_stage_duration_seconds histogram"]
+            for stage, hist in self.stages.items():
+                out += hist.render("payroll_stage_duration_seconds", f'stage="{stage}"')
+
+            out += ["# HELP payroll_rules_fired_total Odpalenia reguł CLIPS (wszystkie sesje).",
+                    "# TYPE payroll_rules_fired_total counter",
+                    f"payroll_rules_fired_total {self.fired}",
+                    "# HELP payroll_rule_firings_sampled_total Odpalenia wg reguły "
+                    "w sesjach próbkowanych.",
+                    "# TYPE payroll_rule_firings_sampled_total counter"]
+            for rule, n in sorted(self.rules_fired.items()):
+                out.append(f'payroll_rule_firings_sampled_total{{rule="{rule}"}} {n}')
+            out += ["# HELP payroll_rule_seconds_sampled_total Czas wg reguły "
+                    "w sesjach próbkowanych.",
+                    "# TYPE payroll_rule_seconds_sampled_total counter"]
+            for rule, secs in sorted(self.rule_seconds.items()):
+                out.append(f'payroll_rule_seconds_sampled_total{{rule="{rule}"}} {secs:.6f}')
+            out += ["# TYPE payroll_rule_sampled_sessions_total counter",
+                    f"payroll_rule_sampled_sessions_total {self.rule_sessions}"]
+
+            out += ["# TYPE payroll_facts_asserted_total counter",
+                    f"payroll_facts_asserted_total {self.facts_asserted}",
+                    "# TYPE payroll_calculations_total counter",
+                    f"payroll_calculations_total {self.calculations}",
+                    "# TYPE payroll_slow_requests_total counter",
+                    f"payroll_slow_requests_total {self.slow_requests}",
+                    "# TYPE payroll_profiles_total counter",
+                    f"payroll_profiles_total {self.profiles}"]
+
+        for name, value in (extra or {}).items():
+            out += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+# ───────────────────────────────────────────────────────────
+#  ŚLAD ŻĄDANIA
+# ───────────────────────────────────────────────────────────
+
+class Trace:
+    __slots__ = ("started", "stages", "fired", "rules", "rule_seconds", "rule_sessions",
+                 "facts", "calculations", "calculation_id", "entered", "left", "slow")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fired = 0
+        self.rules: Counter = Counter()
+        self.rule_seconds: Counter = Counter()
+        self.rule_sessions = 0
+        self.facts = 0
+        self.calculations = 0
+        self.calculation_id: Optional[str] = None
+        self.entered: Optional[float] = None
+        self.left: Optional[float] = None
+        self.slow = 0
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def merge_stages(self, other: "Trace") -> None:
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+
+
+@contextmanager
+def _timed(trace: Trace, name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def stage(name: str):
+    """Mierzy etap w bieżącym śladzie; bez śladu – pusty kontekst."""
+    trace = _current.get()
+    return _NULL if trace is None else _timed(trace, name)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def traced(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """Ustawia `trace` jako bieżący ślad (także dla `run_in_threadpool` w środku)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def annotate(calculation_id: Optional[str] = None, calculations: int = 0,
+             facts: int = 0) -> None:
+    trace = _current.get()
+    if trace is None:
+        return
+    if calculation_id is not None:
+        trace.calculation_id = calculation_id
+    trace.calculations += calculations
+    trace.facts += facts
+
+
+# ───────────────────────────────────────────────────────────
+#  ODPALENIA REGUŁ
+# ───────────────────────────────────────────────────────────
+
+class RuleWatch(Router):
+    """
+    Odbiera wyjście `(watch rules)`: komunikat „FIRE n ” poprzedza nazwę
+    reguły. Czas reguły to odstęp do następnego odpalenia (lub końca
+    `run()`), czyli jej prawa strona wraz z aktualizacją agendy.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("payroll-rule-watch", 40)
+        self._trace: Optional[Trace] = None
+        self._rule: Optional[str] = None
+        self._since = 0.0
+        self._expect_name = False
+
+    def query(self, name: str) -> bool:
+        return self._trace is not None and name == "stdout"
+
+    def write(self, name: str, message: str) -> None:
+        if self._expect_name:
+            self._expect_name = False
+            self._close(time.perf_counter())
+            self._rule = message
+        elif message.startswith("FIRE"):
+            self._expect_name = True
+
+    def _close(self, now: float) -> None:
+        if self._rule is not None:
+            self._trace.rules[self._rule] += 1
+            self._trace.rule_seconds[self._rule] += now - self._since
+        self._since = now
+
+    def run(self, env: Environment, trace: Trace) -> int:
+        self._trace, self._rule = trace, None
+        self._since = time.perf_counter()
+        env.eval("(watch rules)")
+        try:
+            return env.run()
+        finally:
+            self._close(time.perf_counter())
+            env.eval("(unwatch rules)")
+            self._trace = None
+            trace.rule_sessions += 1
+
+
+_watches: "weakref.WeakKeyDictionary[Any, RuleWatch]" = weakref.WeakKeyDictionary()
+
+
+def run_counted(env: Any, trace: Optional[Trace]) -> int:
+    """
+    `run()` środowiska (`CompiledEnvironment`); przy aktywnym śladzie
+    dolicza odpalenia, a w sesjach próbkowanych także rozbicie na reguły.
+    """
+    if trace is None:
+        return env.env.run()
+    if RULE_SAMPLE <= 0 or random.random() >= RULE_SAMPLE:
+        fired = env.env.run()
+    else:
+        watch = _watches.get(env)
+        if watch is None:
+            watch = _watches[env] = RuleWatch()
+            env.env.add_router(watch)
+        fired = watch.run(env.env, trace)
+    trace.fired += fired
+    return fired
+
+
+def instrumented(func: Callable) -> Callable:
+    """Znaczy wejście i wyjście z endpointu (synchronicznego lub async) w śladzie."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            trace = _current.get()
+            if trace is None:
+                return await func(*args, **kwargs)
+            trace.entered = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                trace.left = time.perf_counter()
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return func(*args, **kwargs)
+        trace.entered = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.left = time.perf_counter()
+    return wrapper
+
+
+# ───────────────────────────────────────────────────────────
+#  PROFILOWANIE PRÓBKOWANE
+# ───────────────────────────────────────────────────────────
+
+@contextmanager
+def _profiled() -> Iterator[None]:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        trace = _current.get()
+        tag = (trace.calculation_id if trace and trace.calculation_id else "session")
+        tag = re.sub(r"[^\w.-]", "_", str(tag))[:64]       # calculationId pochodzi od klienta
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}"
+                                         f"-{os.getpid()}-{tag}.prof")
+        profiler.dump_stats(path)
+        with registry._lock:
+            registry.profiles += 1
+        log.info("profil sesji silnika zapisany: %s", path)
+
+
+def maybe_profile():
+    """Z prawdopodobieństwem PAYROLL_PROFILE_RATE profiluje blok cProfile."""
+    if PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE:
+        return _NULL
+    return _profiled()
+
+
+# ───────────────────────────────────────────────────────────
+#  MIDDLEWARE ASGI
+# ───────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """Zakłada ślad dla żądań `/calculate*` i zapisuje go po wysłaniu odpowiedzi."""
+
+    def __init__(self, app: ASGIApp, prefix: str = "/calculate") -> None:
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = 500
+        response_started: Optional[float] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self._finish(scope["path"], status, trace, response_started)
+
+    @staticmethod
+    def _finish(path: str, status: int, trace: Trace, response_started: Optional[float]) -> None:
+        total = time.perf_counter() - trace.started
+        if trace.entered is not None:
+            trace.add("validation", trace.entered - trace.started)
+        if trace.left is not None and response_started is not None:
+            trace.add("serialization", max(0.0, response_started - trace.left))
+
+        if SLOW_MS and total * 1e3 >= SLOW_MS:
+            trace.slow = 1
+            breakdown = ", ".join(f"{k}={v * 1e3:.1f}ms" for k, v in trace.stages.items())
+            log.warning("wolne żądanie %s [%s] %.1f ms (status %s): %s",
+                        path, trace.calculation_id or "-", total * 1e3, status, breakdown)
+        registry.record(path, status, total, trace)
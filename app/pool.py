@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+# ───────────────────────────────────────────────────────────
+#  WYJĄTKI
+# ───────────────────────────────────────────────────────────
+
+class PoolTimeout(Exception):
+    """Nie udało się pobrać środowiska z puli w zadanym czasie."""
+
+
+class PoolClosed(Exception):
+    """Pula została zamknięta – nie wydaje już środowisk."""
+
+
+# ───────────────────────────────────────────────────────────
+#  PULA ŚRODOWISK
+# ───────────────────────────────────────────────────────────
+
+class EnginePool(Generic[T]):
+    """
+    Pula N niezależnych środowisk CLIPS.
+
+    Każde wypożyczenie (`acquire` … `release`) daje wyłączny dostęp do jednego
+    środowiska, więc równoległe obliczenia nie dzielą bazy faktów.
+    Środowisko, w którym obliczenie rzuciło wyjątek, jest odrzucane
+    i zastępowane nowym z `factory`.
+
+    Przy `prefill=False` środowiska powstają przy pierwszych
+    wypożyczeniach (albo w `fill()` – rozgrzaniu).
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], T],
+        size: int,
+        timeout: Optional[float] = None,
+        health_check: Optional[Callable[[T], bool]] = None,
+        prefill: bool = True,
+    ) -> None:
+        if size < 1:
+            raise ValueError("rozmiar puli musi być >= 1")
+        self._factory = factory
+        self._health_check = health_check
+        self.size = size
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle: deque[T] = deque(factory() for _ in range(size if prefill else 0))
+        self._unbuilt = 0 if prefill else size       # miejsca bez środowiska
+        self._closed = False
+
+        # ── metryki
+        self._in_use = 0
+        self._waiters = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._replacements = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # ── wypożyczanie ─────────────────────────────────────────
+
+    def acquire(self, timeout: Optional[float] = None) -> T:
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+        build = False
+
+        with self._cond:
+            self._waiters += 1
+            try:
+                while not self._idle:
+                    if self._closed:
+                        raise PoolClosed("pula środowisk CLIPS jest zamknięta")
+                    if self._unbuilt:
+                        self._unbuilt -= 1
+                        build = True
+                        break
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"brak wolnego środowiska CLIPS po {timeout:.3f} s"
+                        )
+                    self._cond.wait(remaining)
+                if self._closed:
+                    raise PoolClosed("pula środowisk CLIPS jest zamknięta")
+                env = None if build else self._idle.popleft()
+            finally:
+                self._waiters -= 1
+
+            waited = time.perf_counter() - started
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        if build:
+            try:
+                env = self._factory()
+            except BaseException:
+                with self._cond:
+                    self._in_use -= 1
+                    self._unbuilt += 1
+                    self._cond.notify()
+                raise
+        return env
+
+    def release(self, env: T, broken: bool = False) -> None:
+        if broken or (self._health_check is not None and not self._health_check(env)):
+            try:
+                env = self._factory()
+            except Exception:
+                # nie da się teraz odtworzyć środowiska – miejsce wraca jako
+                # niezbudowane, kolejne `acquire()`/`fill()` spróbuje ponownie
+                with self._cond:
+                    self._in_use -= 1
+                    self._unbuilt += 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._replacements += 1
+
+        with self._cond:
+            self._in_use -= 1
+            if not self._closed:                 # po zamknięciu środowisko przepada
+                self._idle.append(env)
+            self._cond.notify()
+
+    # ── utrzymanie ───────────────────────────────────────────
+
+    def fill(self) -> int:
+        """Buduje brakujące środowiska (rozgrzanie). Zwraca liczbę zbudowanych."""
+        built = 0
+        while True:
+            with self._cond:
+                if self._closed or not self._unbuilt:
+                    return built
+                self._unbuilt -= 1
+            try:
+                env = self._factory()
+            except BaseException:
+                with self._cond:
+                    self._unbuilt += 1
+                raise
+            with self._cond:
+                if self._closed:
+                    return built
+                self._idle.append(env)
+                self._cond.notify()
+            built += 1
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "size": self.size,
+                "inUse": self._in_use,
+                "idle": len(self._idle),
+                "unbuilt": self._unbuilt,
+                "waiters": self._waiters,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "replacements": self._replacements,
+                "waitTimeTotal": round(self._wait_total, 6),
+                "waitTimeMax": round(self._wait_max, 6),
+                "waitTimeAvg": round(self._wait_total / self._checkouts, 6)
+                if self._checkouts else 0.0,
+            }
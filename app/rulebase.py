@@ -0,0 +1,237 @@
+"""
+Baza reguł: plik `.clp`, jego odcisk i skompilowany obraz binarny CLIPS.
+
+`RuleBase` to niezmienna wersja reguł – treść pliku jest czytana raz,
+przy tworzeniu, a obraz `bsave` trafia do PAYROLL_IMAGE_DIR pod nazwą
+wyprowadzoną z SHA-256 treści. Kolejne środowiska (także w innych
+procesach i po restarcie) ładują obraz przez `bload`, bez parsowania
+reguł. Uszkodzony albo niezgodny obraz jest kompilowany od nowa.
+
+`bload` wykonuje to, co jest w obrazie, więc obraz musi pochodzić od nas:
+katalog jest prywatny (0700, właścicielem jest bieżący użytkownik – inaczej
+obrazy są wyłączone), pliki tymczasowe powstają przez `mkstemp`, a obok
+obrazu leży `.sha256` z jego skrótem; obraz, który się z nim nie zgadza
+(albo ma obcego właściciela / prawa zapisu dla innych), jest kompilowany
+od nowa.
+"""
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import stat
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+import clips
+from clips import Environment
+
+from app.facts import CompiledEnvironment
+
+IMAGE_DIR = os.getenv("PAYROLL_IMAGE_DIR", os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "payroll-clips"))                                                       # "" → bez obrazów
+
+# Struktura reguł (bez `defglobal` i komentarzy), którą odwzorowują w Pythonie
+# `app.vector.compute` i `app.facts.DOWNSTREAM`. Inna struktura po przeładowaniu
+# → silnik vector i przyrostowe scenariusze liczą przez CLIPS. Po zmianie
+# reguł: popraw oba odwzorowania, sprawdź `python -m app.equivalence`
+# i wpisz tu skrót, który ono wypisze.
+MIRRORED_STRUCTURE = "99fd7bffd161c802cc513e3dc73d776d86240cf3dca774ac491b862cfd620f8b"
+
+log = logging.getLogger("app.rulebase")
+
+
+# ───────────────────────────────────────────────────────────
+#  ODCISK PLIKU
+# ───────────────────────────────────────────────────────────
+
+class RulesFingerprint:
+    """SHA-256 pliku reguł, liczony ponownie tylko po zmianie mtime/rozmiaru."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._stat: Optional[Tuple[int, int]] = None
+        self._digest = ""
+
+    def __call__(self) -> str:
+        st = os.stat(self.path)
+        stat = (st.st_mtime_ns, st.st_size)
+        if stat != self._stat:
+            with open(self.path, "rb") as fh:
+                self._digest = hashlib.sha256(fh.read()).hexdigest()
+            self._stat = stat
+        return self._digest
+
+
+# ───────────────────────────────────────────────────────────
+#  STRUKTURA REGUŁ
+# ───────────────────────────────────────────────────────────
+
+def _strip_defglobals(text: str) -> str:
+    out, pos = [], 0
+    while True:
+        start = text.find("(defglobal", pos)
+        if start < 0:
+            out.append(text[pos:])
+            return "".join(out)
+        out.append(text[pos:start])
+        depth, idx = 0, start
+        while idx < len(text):
+            depth += {"(": 1, ")": -1}.get(text[idx], 0)
+            idx += 1
+            if depth == 0:
+                break
+        pos = idx
+
+
+def structure_digest(text: str) -> str:
+    """SHA-256 szablonów i reguł – bez `defglobal`, komentarzy i białych znaków."""
+    code = re.sub(r";[^\n]*", "", text)
+    return hashlib.sha256(" ".join(_strip_defglobals(code).split()).encode()).hexdigest()
+
+
+# ───────────────────────────────────────────────────────────
+#  PRYWATNY KATALOG OBRAZÓW
+# ───────────────────────────────────────────────────────────
+
+def _owned(st: os.stat_result, group_other: int) -> bool:
+    uid = getattr(os, "getuid", None)
+    return (uid is None or st.st_uid == uid()) and not st.st_mode & group_other
+
+
+def _private_dir(path: str) -> bool:
+    """Tworzy katalog 0700; True, gdy to nasz katalog bez dostępu dla innych."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError as ex:
+        log.warning("katalog obrazów reguł %s niedostępny: %s", path, ex)
+        return False
+    if not stat.S_ISDIR(st.st_mode) or not _owned(st, 0o077):
+        log.warning("katalog obrazów reguł %s nie jest prywatny (właściciel/prawa) – "
+                    "obrazy wyłączone", path)
+        return False
+    return True
+
+
+def _file_digest(path: str) -> str:
+    with open(path, "rb") as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def _write_private(directory: str, target: str, write) -> None:
+    """Zapis przez `mkstemp` w tym samym katalogu i atomowe `os.replace`."""
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        os.close(fd)
+        write(tmp)
+        os.replace(tmp, target)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+
+
+# ───────────────────────────────────────────────────────────
+#  WERSJA REGUŁ
+# ───────────────────────────────────────────────────────────
+
+class RuleBase:
+    """Jedna wersja reguł: ścieżka, treść, SHA-256 i obraz `bsave`."""
+
+    def __init__(self, path: str, image_dir: Optional[str] = IMAGE_DIR) -> None:
+        self.path = os.path.abspath(path)
+        with open(self.path, "rb") as fh:
+            self.source = fh.read()
+        self.text = self.source.decode("utf-8")
+        self.digest = hashlib.sha256(self.source).hexdigest()
+        self.structure = structure_digest(self.text)
+        # czy app.vector / facts.DOWNSTREAM odpowiadają tym regułom
+        self.mirrored = self.structure == MIRRORED_STRUCTURE
+        if not self.mirrored:
+            log.warning("struktura reguł %s (%s…) różni się od odwzorowanej w app.vector "
+                        "i facts.DOWNSTREAM – silnik vector i scenariusze liczą przez CLIPS",
+                        self.path, self.structure[:12])
+        self.image = (os.path.join(image_dir, f"payroll-{self.digest[:16]}"
+                                              f"-clipspy{clips.__version__}.bin")
+                      if image_dir and _private_dir(image_dir) else None)
+        self._lock = threading.Lock()
+        self._compiled = False
+
+    def _load_source(self) -> Environment:
+        """Parsuje treść z chwili utworzenia (nie bieżący stan pliku)."""
+        env = Environment()
+        if RulesFingerprint(self.path)() == self.digest:
+            env.load(self.path)                 # komunikaty błędów z prawdziwą ścieżką
+        else:
+            fd, tmp = tempfile.mkstemp(suffix=".clp")
+            try:
+                with os.fdopen(fd, "wb") as fh:
+                    fh.write(self.source)
+                env.load(tmp)
+            finally:
+                os.unlink(tmp)
+        CompiledEnvironment(env)                # brakujące szablony → LookupError
+        return env
+
+    def _image_ok(self) -> bool:
+        """Obraz nasz, niezapisywalny dla innych i zgodny ze skrótem `.sha256`."""
+        try:
+            st = os.lstat(self.image)
+            if not stat.S_ISREG(st.st_mode) or not _owned(st, 0o022):
+                log.warning("obraz reguł %s ma obcego właściciela albo prawa – pomijam",
+                            self.image)
+                return False
+            with open(f"{self.image}.sha256", encoding="ascii") as fh:
+                expected = fh.read().strip()
+            return _file_digest(self.image) == expected
+        except OSError:
+            return False
+
+    def compile(self) -> None:
+        """Sprawdza reguły i zapisuje obraz, jeśli jeszcze nie ma poprawnego."""
+        with self._lock:
+            if self._compiled:
+                return
+            if self.image and self._image_ok():
+                self._compiled = True           # obraz z poprzedniego startu / innego procesu
+                return
+            env = self._load_source()
+            if self.image:
+                directory, digest = os.path.dirname(self.image), []
+
+                def save_image(tmp: str) -> None:
+                    env.save(tmp, binary=True)
+                    digest.append(_file_digest(tmp))    # skrót tego, co zapisaliśmy
+
+                def save_digest(tmp: str) -> None:
+                    with open(tmp, "w", encoding="ascii") as fh:
+                        fh.write(digest[0] + "\n")
+
+                _write_private(directory, self.image, save_image)
+                _write_private(directory, f"{self.image}.sha256", save_digest)
+                log.info("obraz reguł zapisany: %s", self.image)
+            self._compiled = True
+
+    def new_environment(self) -> CompiledEnvironment:
+        self.compile()
+        if self.image:
+            env = Environment()
+            try:
+                if not self._image_ok():
+                    raise LookupError("obraz niezgodny ze skrótem")
+                env.load(self.image, binary=True)
+                return CompiledEnvironment(env)
+            except (clips.CLIPSError, LookupError):
+                log.warning("obraz reguł %s nieczytelny – kompilacja od nowa", self.image)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.image)
+                self._compiled = False
+                self.compile()
+        return CompiledEnvironment(self._load_source())
+
+    def info(self) -> dict:
+        return {"path": self.path, "sha256": self.digest, "image": self.image,
+                "structure": self.structure, "mirrored": self.mirrored}
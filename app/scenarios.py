@@ -0,0 +1,256 @@
+"""
+Scenariusze „co jeśli”: jeden payload bazowy i wiele wariantów.
+
+Baza jest liczona raz; jej fakty zostają w środowisku. Wariant zmienia
+(`modify`) tylko te fakty wejściowe, których sloty faktycznie się różnią
+od bieżących, wycofuje fakty pochodne zależne od nich (`DOWNSTREAM`)
+i uruchamia agendę – ponownie odpalają tylko reguły zależne od zmiany,
+np. calc-overtime → calc-gross → zaliczka/składki → calc-net. Warianty
+są liczone względem bazy, nie poprzedniego wariantu. Gdy struktura
+bieżących reguł różni się od tej, dla której spisano `DOWNSTREAM`
+(`RuleBase.mirrored`), każdy wariant jest liczony od zera.
+
+    run_scenarios(payload, grid={"overtime.overtime50h": [0, 5, 10],
+                                 "allowances.performanceBonus": ScenarioRange(...)})
+"""
+import itertools
+import os
+from decimal import Decimal
+from typing import (Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Type,
+                    Union)
+
+from pydantic import BaseModel
+
+from app import metrics
+from app.engine import _build_result, _dec, checkout, get_rules
+from app.facts import DOWNSTREAM, SLOT_TABLES, CompiledEnvironment
+from app.schemas import PayrollPayload, ScenarioRange, ScenarioTable
+
+MAX_VARIANTS = int(os.getenv("PAYROLL_SCENARIO_MAX", "10000"))
+
+# kolumny tabeli wyników (po wartościach parametrów) → (szablon, slot)
+RESULT_SLOTS = {
+    "gross":           ("components", "gross"),
+    "overtimePay":     ("components", "overtime-pay"),
+    "bonuses":         ("components", "allow-pay"),
+    "baseSalary":      ("components", "base-salary"),
+    "travelPay":       ("components", "travel-pay"),
+    "socialInsurance": ("deductions", "social"),
+    "healthInsurance": ("deductions", "health"),
+    "ppkContribution": ("deductions", "ppk"),
+    "other":           ("deductions", "other"),
+    "tax-adv":         ("deductions", "tax-adv"),
+    "net":             ("summary", "net"),
+}
+RESULT_COLUMNS = tuple(RESULT_SLOTS)
+
+Facts = Dict[str, Dict[str, Any]]   # wynik `CompiledEnvironment.collect()` dla calc-id
+
+Variant = Dict[str, Any]            # "sekcja.pole" → wartość
+
+
+# ───────────────────────────────────────────────────────────
+#  WARIANTY
+# ───────────────────────────────────────────────────────────
+
+def _range(spec: ScenarioRange, limit: int) -> List[Decimal]:
+    count = int((spec.stop - spec.start) // spec.step) + 1 if spec.stop >= spec.start else 0
+    if count > limit:
+        raise ValueError(f"za dużo wartości w zakresie: {count} (limit {limit})")
+    values, value = [], spec.start
+    while value <= spec.stop:
+        values.append(value)
+        value += spec.step
+    return values
+
+
+def expand(
+    deltas: Sequence[Variant] = (),
+    grid: Optional[Mapping[str, Union[Sequence[Any], ScenarioRange]]] = None,
+    limit: int = MAX_VARIANTS,
+) -> List[Variant]:
+    """
+    Lista wariantów: najpierw `deltas`, potem iloczyn kartezjański siatki
+    (ostatni parametr zmienia się najszybciej, więc kolejne warianty
+    różnią się zwykle jednym faktem).
+    """
+    variants = [dict(delta) for delta in deltas]
+    if grid:
+        axes = [(path, _range(values, limit) if isinstance(values, ScenarioRange) else list(values))
+                for path, values in grid.items()]
+        count = 1
+        for _, values in axes:
+            count *= len(values)
+        if len(variants) + count > limit:
+            raise ValueError(f"za dużo wariantów: {len(variants) + count} (limit {limit})")
+        paths = [path for path, _ in axes]
+        variants.extend(dict(zip(paths, point))
+                        for point in itertools.product(*(values for _, values in axes)))
+    if len(variants) > limit:
+        raise ValueError(f"za dużo wariantów: {len(variants)} (limit {limit})")
+    return variants
+
+
+def _parameters(variants: Iterable[Variant]) -> List[str]:
+    seen: Dict[str, None] = {}
+    for variant in variants:
+        seen.update(dict.fromkeys(variant))
+    return list(seen)
+
+
+# sekcje payloadu odwzorowane na fakty wejściowe
+SECTIONS: Dict[str, Type[BaseModel]] = {
+    section: PayrollPayload.model_fields[section].annotation
+    for _, section, _, _ in SLOT_TABLES
+}
+
+
+def check_parameters(paths: Iterable[str]) -> None:
+    """Ścieżki "sekcja.pole" sprawdzane na schemacie – bez silnika."""
+    for path in paths:
+        section, _, field = path.partition(".")
+        model = SECTIONS.get(section)
+        if model is None or field not in model.model_fields:
+            raise ValueError(f"nieznany parametr scenariusza: {path!r} "
+                             f"(dostępne sekcje: {', '.join(SECTIONS)})")
+
+
+# ───────────────────────────────────────────────────────────
+#  SESJA PRZYROSTOWA
+# ───────────────────────────────────────────────────────────
+
+def _same(a: Any, b: Any) -> bool:
+    # 1 i 1.0 to dla CLIPS różne wartości (INTEGER / FLOAT)
+    return type(a) is type(b) and a == b
+
+
+class ScenarioSession:
+    """Baza policzona w środowisku; warianty przez `modify` faktów wejściowych."""
+
+    def __init__(self, env: CompiledEnvironment, base: PayrollPayload,
+                 incremental: bool = True) -> None:
+        self.env = env
+        self.base = base
+        # False → każdy wariant liczony od zera (reguły inne niż w `DOWNSTREAM`)
+        self.incremental = incremental
+        self._sections = {section: getattr(base, section) for section in env.sections}
+        self._dumps: Dict[str, Dict[str, Any]] = {}
+        self._start()
+
+    def _start(self) -> None:
+        env = self.env
+        env.env.reset()
+        self._facts = env.assert_payload(self.base, 0)
+        self._values = [env.slot_values(idx, self._sections[section])
+                        for section, idx in sorted(env.sections.items(), key=lambda kv: kv[1])]
+        self._base_values = [dict(values) for values in self._values]
+        self._dirty: Set[int] = set()
+        env.env.run()
+        self.base_facts = self._current = env.collect().get(0)
+        self.base_result = _build_result(self._current)
+
+    # ── modele sekcji wariantu ───────────────────────────────
+
+    def _section_models(self, variant: Variant) -> Dict[str, BaseModel]:
+        """Waliduje zmiany sekcjami (tylko zmienione sekcje, nie cały payload)."""
+        check_parameters(variant)
+        updates: Dict[str, Dict[str, Any]] = {}
+        for path, value in variant.items():
+            section, _, field = path.partition(".")
+            updates.setdefault(section, {})[field] = value
+        models = {}
+        for section, fields in updates.items():
+            model = self._sections[section]
+            dump = self._dumps.get(section)
+            if dump is None:
+                dump = self._dumps[section] = model.model_dump()
+            models[section] = type(model).model_validate({**dump, **fields})
+        return models
+
+    # ── liczenie wariantu ────────────────────────────────────
+
+    def evaluate(self, variant: Variant) -> Optional[Facts]:
+        """Liczy wariant; zwraca surowe fakty wynikowe (bez budowania modelu)."""
+        env = self.env
+        models = self._section_models(variant)
+        if not self.incremental:
+            env.env.reset()
+            env.assert_payload(self.base.model_copy(update=models), 0)
+            env.env.run()
+            return env.collect().get(0)
+        targets: Dict[int, Dict[bytes, Any]] = {}
+        for section, model in models.items():
+            idx = env.sections[section]
+            targets[idx] = env.slot_values(idx, model)
+        for idx in self._dirty - targets.keys():
+            targets[idx] = self._base_values[idx]          # powrót do bazy
+
+        changes: List[Tuple[int, Dict[bytes, Any]]] = []
+        for idx, target in targets.items():
+            current = self._values[idx]
+            diff = {slot: v for slot, v in target.items() if not _same(current[slot], v)}
+            if diff:
+                changes.append((idx, diff))
+        if not changes:
+            return self._current
+
+        try:
+            derived: Dict[str, None] = {}
+            for idx, _ in changes:
+                derived.update(dict.fromkeys(DOWNSTREAM[env.templates[idx]]))
+            env.retract_derived(derived)
+            for idx, diff in changes:
+                self._facts[idx] = env.modify(self._facts[idx], diff)
+                self._values[idx].update(diff)
+                if self._values[idx] == self._base_values[idx]:
+                    self._dirty.discard(idx)
+                else:
+                    self._dirty.add(idx)
+            env.env.run()
+            self._current = env.collect().get(0)
+        except Exception:
+            self._start()          # stan środowiska nieznany – od bazy
+            raise
+        return self._current
+
+
+# ───────────────────────────────────────────────────────────
+#  TABELA WYNIKÓW
+# ───────────────────────────────────────────────────────────
+
+def _columns(facts: Optional[Facts]) -> List[Decimal]:
+    if not facts or any(template not in facts for template, _ in RESULT_SLOTS.values()):
+        raise RuntimeError("silnik reguł nie wyznaczył wyniku dla tego obliczenia")
+    return [_dec(facts[template][slot]) for template, slot in RESULT_SLOTS.values()]
+
+
+def run_scenarios(
+    base: PayrollPayload,
+    deltas: Sequence[Variant] = (),
+    grid: Optional[Mapping[str, Union[Sequence[Any], ScenarioRange]]] = None,
+) -> ScenarioTable:
+    """Liczy bazę i warianty w jednym środowisku; zwraca zwartą tabelę."""
+    variants = expand(deltas, grid)
+    parameters = _parameters(variants)
+    check_parameters(parameters)          # błąd użytkownika nie psuje środowiska z puli
+    rows: List[List[Any]] = []
+    errors: Dict[int, str] = {}
+
+    with checkout() as env:
+        session = ScenarioSession(env, base, incremental=get_rules().mirrored)
+        for idx, variant in enumerate(variants):
+            params = [variant.get(path) for path in parameters]
+            try:
+                rows.append(params + _columns(session.evaluate(variant)))
+            except Exception as ex:  # noqa: BLE001
+                errors[idx] = str(ex)
+                rows.append(params + [None] * len(RESULT_COLUMNS))
+    metrics.annotate(calculations=len(variants) + 1)
+
+    return ScenarioTable(
+        parameters=parameters,
+        columns=parameters + list(RESULT_COLUMNS),
+        base=_columns(session.base_facts),
+        rows=rows,
+        errors=errors,
+    )
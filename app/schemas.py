@@ -2,7 +2,7 @@ from __future__ import annotations
 from decimal import Decimal
 from datetime import date, datetime
 from enum import Enum
-from typing import List, Optional, Dict
+from typing import Any, Dict, List, Optional, Union
 from pydantic import BaseModel, Field, condecimal, conint
 
 class ContractType(str, Enum):
@@ -25,6 +25,7 @@ class CurrencyCode(str, Enum):
 
 
 class Employee(BaseModel):
+    employeeId: Optional[str] = None      # klucz w rejestrze YTD (app.ledger wymaga)
     firstName: str
     lastName: str
     contractType: ContractType
@@ -101,6 +102,8 @@ class TaxParameters(BaseModel):
     taxFreeAllowanceMonthly: Decimal
     costsOfIncomeMonthly: Decimal
     taxThresholds: List[TaxThreshold]
+    # przychód (brutto) od początku roku przed tym okresem – uzupełnia app.ledger
+    ytdGross: condecimal(ge=0) = 0
 
 
 class Timesheet(BaseModel):
@@ -141,4 +144,46 @@ class PayrollResult(BaseModel):
     overtimePay: Decimal
     bonuses: Decimal
     details: Dict[str, Decimal]
-    calculatedAt: datetime
\ No newline at end of file
+    calculatedAt: datetime
+
+class PayrollBatchResult(BaseModel):
+    results: Dict[str, PayrollResult] = Field(default_factory=dict)
+    errors: Dict[str, str] = Field(default_factory=dict)
+
+
+# ── scenariusze „co jeśli” (app.scenarios) ───────────────────────
+class ScenarioRange(BaseModel):
+    start: Decimal
+    stop: Decimal                       # włącznie
+    step: condecimal(gt=0)
+
+
+class ScenarioRequest(BaseModel):
+    base: PayrollPayload
+    # zmiany jako ścieżki "sekcja.pole", np. {"overtime.overtime50h": 10}
+    deltas: List[Dict[str, Any]] = Field(default_factory=list)
+    # siatka: iloczyn kartezjański list wartości / zakresów
+    grid: Dict[str, Union[List[Any], ScenarioRange]] = Field(default_factory=dict)
+
+
+class ScenarioTable(BaseModel):
+    parameters: List[str]
+    columns: List[str]
+    base: List[Decimal]
+    rows: List[List[Any]]               # wartości parametrów + kolumny wyniku
+    errors: Dict[int, str] = Field(default_factory=dict)
+
+
+# ── rejestr narastający YTD (app.ledger) ─────────────────────────
+class LedgerPeriod(BaseModel):
+    period: date                        # payPeriodStart
+    ytdBefore: Decimal                  # brutto od początku roku przed okresem
+    gross: Decimal
+    taxAdvance: Decimal
+    net: Decimal
+
+
+class LedgerHistory(BaseModel):
+    employee: str
+    taxYear: int
+    periods: List[LedgerPeriod]
@@ -0,0 +1,202 @@
+"""
+Strumieniowe liczenie list płac w formacie NDJSON (JSON Lines).
+
+Wejście to jeden `PayrollPayload` na linię, wyjście – jeden
+`PayrollResult` na linię (w kolejności wejścia) albo obiekt błędu
+`{"line": …, "calculationId": …, "error": …}`. Linie są liczone
+porcjami przez `run_payroll_batch`, więc pamięć zależy od rozmiaru
+porcji, a nie od rozmiaru pliku. Linia żądania HTTP dłuższa niż
+`PAYROLL_STREAM_MAX_LINE` bajtów nie jest buforowana – dostaje obiekt błędu.
+
+    python -m app.stream lista.jsonl -o wyniki.jsonl
+    cat lista.jsonl | python -m app.stream - > wyniki.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.engine import run_payroll_batch
+from app.schemas import PayrollPayload
+
+STREAM_CHUNK_SIZE = int(os.getenv("PAYROLL_STREAM_CHUNK_SIZE", "256"))
+STREAM_MAX_LINE = int(os.getenv("PAYROLL_STREAM_MAX_LINE", str(1024 * 1024)))
+
+Line = Tuple[int, str]
+
+
+# ───────────────────────────────────────────────────────────
+#  LICZENIE PORCJI
+# ───────────────────────────────────────────────────────────
+
+def _error_line(lineno: int, calc_id: Optional[str], message: str) -> str:
+    return json.dumps({"line": lineno, "calculationId": calc_id, "error": message},
+                      ensure_ascii=False) + "\n"
+
+
+def calculate_lines(lines: Sequence[Line]) -> List[str]:
+    """Liczy porcję linii `(numer, tekst)` i zwraca gotowe linie NDJSON."""
+    out: List[Optional[str]] = [None] * len(lines)
+    slots: List[int] = []
+    payloads: List[PayrollPayload] = []
+
+    for idx, (lineno, text) in enumerate(lines):
+        try:
+            payloads.append(PayrollPayload.model_validate_json(text))
+        except ValidationError as ex:
+            out[idx] = _error_line(lineno, None, str(ex))
+            continue
+        slots.append(idx)
+
+    try:
+        results = run_payroll_batch(payloads)
+    except Exception as ex:  # noqa: BLE001
+        results = [ex] * len(payloads)
+
+    for idx, payload, res in zip(slots, payloads, results):
+        if isinstance(res, Exception):
+            out[idx] = _error_line(lines[idx][0], payload.meta.calculationId, str(res))
+        else:
+            out[idx] = res.model_dump_json() + "\n"
+    return out
+
+
+# ───────────────────────────────────────────────────────────
+#  POTOKI GENERATORÓW
+# ───────────────────────────────────────────────────────────
+
+def _numbered(lines: Iterable[str]) -> Iterator[Line]:
+    for lineno, text in enumerate(lines, start=1):
+        if text.strip():
+            yield lineno, text
+
+
+def iter_ndjson(lines: Iterable[str], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Synchroniczny potok: linie wejściowe → linie wynikowe, porcja po porcji."""
+    chunk: List[Line] = []
+    for line in _numbered(lines):
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield from calculate_lines(chunk)
+            chunk = []
+    if chunk:
+        yield from calculate_lines(chunk)
+
+
+async def _aiter_lines(
+    body: AsyncIterator[bytes], max_line: int
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """
+    Numerowane linie strumienia bajtów; `None` zamiast linii dłuższej niż
+    `max_line`. Dzielony jest tylko nowo odebrany blok, a z za długiej
+    linii zostaje sama jej długość.
+    """
+    parts: List[bytes] = []
+    size = 0
+    lineno = 0
+
+    async for data in body:
+        *complete, tail = data.split(b"\n")
+        for piece in complete:
+            lineno += 1
+            size += len(piece)
+            yield lineno, (b"".join(parts) + piece if size <= max_line else None)
+            parts, size = [], 0
+        size += len(tail)
+        if size <= max_line:
+            parts.append(tail)
+        else:
+            parts = []
+
+    if size:
+        yield lineno + 1, (b"".join(parts) if size <= max_line else None)
+
+
+async def aiter_ndjson(
+    body: AsyncIterator[bytes],
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    max_line: int = STREAM_MAX_LINE,
+) -> AsyncIterator[str]:
+    """
+    Asynchroniczny potok dla treści żądania HTTP: dzieli strumień bajtów
+    na linie, a porcje liczy w puli wątków, nie blokując pętli zdarzeń.
+    """
+    chunk: List[Line] = []
+
+    async for lineno, raw in _aiter_lines(body, max_line):
+        if raw is None:
+            # najpierw porcja sprzed odrzuconej linii – kolejność jak na wejściu
+            if chunk:
+                for out in await run_in_threadpool(calculate_lines, chunk):
+                    yield out
+                chunk = []
+            yield _error_line(lineno, None, f"linia dłuższa niż {max_line} bajtów")
+            continue
+        if raw.strip():
+            chunk.append((lineno, raw.decode("utf-8", "replace")))
+        if len(chunk) >= chunk_size:
+            for out in await run_in_threadpool(calculate_lines, chunk):
+                yield out
+            chunk = []
+
+    if chunk:
+        for out in await run_in_threadpool(calculate_lines, chunk):
+            yield out
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Odpowiedź strumieniowa wysyłana w trakcie czytania treści żądania.
+
+    `StreamingResponse` nasłuchuje rozłączenia klienta przez `receive`,
+    przez co podkrada komunikaty z treścią żądania czytaną przez potok.
+    Tu rozłączenie sygnalizuje samo czytanie żądania (`ClientDisconnect`).
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# ───────────────────────────────────────────────────────────
+#  CLI
+# ───────────────────────────────────────────────────────────
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.stream",
+                                     description="Liczenie listy płac NDJSON → NDJSON.")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="plik .jsonl z payloadami albo '-' dla stdin")
+    parser.add_argument("-o", "--output", help="plik wynikowy .jsonl (domyślnie stdout)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    src = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    dst = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        pending = 0
+        for line in iter_ndjson(src, args.chunk_size):
+            dst.write(line)
+            pending += 1
+            if pending >= args.chunk_size:
+                dst.flush()
+                pending = 0
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Generator syntetycznych, powtarzalnych (seed) payloadów płacowych.
+
+Pokrywa wszystkie rodzaje umów, studentów, różne kombinacje nadgodzin,
+delegacji, dodatków i potrąceń oraz przypadki brzegowe (zero godzin,
+dni świąteczne jako norma, zerowe i bardzo wysokie kwoty, stawki 0).
+"""
+import random
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Iterator, List, Optional
+
+from app.schemas import ContractType, CurrencyCode, PayrollPayload
+
+_FIRST_NAMES = ["Jan", "Anna", "Piotr", "Katarzyna", "Tomasz", "Zofia", "Michał", "Ewa"]
+_LAST_NAMES = ["Kowalski", "Nowak", "Wiśniewska", "Wójcik", "Kamiński", "Lewandowska"]
+
+
+def _money(rng: random.Random, lo: float, hi: float, p_zero: float = 0.5) -> Decimal:
+    if rng.random() < p_zero:
+        return Decimal(0)
+    if rng.random() < 0.3:
+        return Decimal(rng.randint(int(lo), int(hi)))
+    return Decimal(f"{rng.uniform(lo, hi):.2f}")
+
+
+def _pct(rng: random.Random, choices: List[str]) -> Optional[Decimal]:
+    choice = rng.choice(choices)
+    return None if choice is None else Decimal(choice)
+
+
+def random_payload(rng: random.Random, index: int = 0, edge_cases: bool = True) -> PayrollPayload:
+    contract = rng.choice(list(ContractType))
+    edge = edge_cases and rng.random() < 0.1
+
+    hours = rng.choice([160, 160, 160, 168, 120, 80]) if not edge else rng.choice([0, 1, 300])
+    if rng.random() < 0.2:
+        hours = Decimal(f"{rng.uniform(40, 200):.1f}")
+
+    year = rng.choice([2024, 2025])
+    month = rng.randint(1, 12)
+    start = date(year, month, 1)
+    end = date(year, month, 28)
+
+    perf_hi = 250_000 if edge else 5_000
+    return PayrollPayload.model_validate({
+        "employee": {
+            "firstName": rng.choice(_FIRST_NAMES),
+            "lastName": rng.choice(_LAST_NAMES),
+            "contractType": contract,
+            "isStudent": rng.random() < 0.2,
+        },
+        "position": {"currency": rng.choice(list(CurrencyCode))},
+        "period": {"payPeriodStart": start, "payPeriodEnd": end},
+        "overtime": {
+            "overtime50h": _money(rng, 1, 30, p_zero=0.4),
+            "overtime100h": _money(rng, 1, 16, p_zero=0.6),
+            "overtimeNightH": _money(rng, 1, 10, p_zero=0.8),
+            "overtime50Multiplier": rng.choice([Decimal("1.5"), Decimal("1.5"), Decimal("1.75")]),
+            "overtime100Multiplier": rng.choice([Decimal("2.0"), Decimal("2"), Decimal("2.5")]),
+        },
+        "travel": {
+            "travelDaysDomestic": _money(rng, 1, 10, p_zero=0.7),
+            "travelDaysAbroad": _money(rng, 1, 10, p_zero=0.85),
+            "dietRateDomestic": Decimal("45"),
+            "dietRateAbroad": Decimal("49.50"),
+            "accommodationCost": _money(rng, 100, 2000, p_zero=0.8),
+            "lumpSumTransport": _money(rng, 10, 300, p_zero=0.8),
+            "privateCarKm": _money(rng, 10, 1500, p_zero=0.8),
+            "privateCarRatePerKm": Decimal("0.8358"),
+        },
+        "allowances": {
+            "seniorityBonusPct": rng.choice([Decimal(0), Decimal("0.05"), Decimal("0.1"), Decimal("0.2")]),
+            "functionAllowance": _money(rng, 100, 1500),
+            "performanceBonus": _money(rng, 100, perf_hi),
+            "regulationBonus": _money(rng, 50, 800, p_zero=0.7),
+            "nightWorkAllowance": _money(rng, 20, 400, p_zero=0.8),
+            "weekendHolidayAllowance": _money(rng, 20, 600, p_zero=0.8),
+            "remoteWorkAllowance": _money(rng, 20, 300, p_zero=0.7),
+            "medicalBenefitValue": _money(rng, 50, 250, p_zero=0.6),
+            "companyCarBenefitValue": _money(rng, 250, 400, p_zero=0.85),
+        },
+        "deductions": {
+            "employeeSocialInsurancePct": _pct(rng, [None, None, "0.1371", "0", "0.0976"]),
+            "healthInsurancePct": _pct(rng, [None, None, "0.09", "0"]),
+            "ppkEmployeePct": _pct(rng, [None, "0", "0.02", "0.035"]),
+            "bailDeduction": _money(rng, 50, 1500, p_zero=0.85),
+        },
+        "tax": {
+            "taxYear": year,
+            "taxFreeAllowanceMonthly": Decimal("300"),
+            "costsOfIncomeMonthly": Decimal("250"),
+            "taxThresholds": [{"threshold": Decimal("120000"), "rate": Decimal("0.12")},
+                              {"threshold": Decimal("1000000000"), "rate": Decimal("0.32")}],
+            "ytdGross": _money(rng, 1_000, 200_000, p_zero=0.5),
+        },
+        "timesheet": {
+            "hoursWorked": hours,
+            "publicHolidaysInPeriod": rng.choice([0, 0, 0, 1, 2]) if edge else 0,
+        },
+        "meta": {
+            "calculationId": f"syn-{index:07d}",
+            "createdAt": datetime(year, month, 28, 12, 0, tzinfo=timezone.utc),
+            "createdBy": "synthetic",
+            "sourceSystem": "SYNTHETIC",
+        },
+    })
+
+
+def iter_payloads(n: int, seed: int = 0, edge_cases: bool = True) -> Iterator[PayrollPayload]:
+    rng = random.Random(seed)
+    for i in range(n):
+        yield random_payload(rng, i, edge_cases)
+
+
+def generate_payloads(n: int, seed: int = 0, edge_cases: bool = True) -> List[PayrollPayload]:
+    return list(iter_payloads(n, seed, edge_cases))
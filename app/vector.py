@@ -0,0 +1,185 @@
+"""
+Kolumnowy (NumPy) odpowiednik reguł z `payroll.clp`.
+
+Liczy całą partię naraz: każdy slot wejściowy to kolumna float64,
+gałęzie po rodzaju umowy i statusie studenta to maski. Kolejność
+i łączność działań odwzorowują wyrażenia CLIPS 1:1 (CLIPS liczy
+w double, n-arne `+`/`*` od lewej), więc po `_dec` wyniki są identyczne
+jak z silnika reguł – sprawdza to `python -m app.equivalence`.
+Stałe (`?*SOC_INS_EMP_PCT*` itd.) są czytane z aktualnej wersji reguł,
+więc przeładowanie `payroll.clp` obejmuje też ten silnik.
+"""
+import re
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+from app.engine import _dec
+from app.rulebase import RuleBase
+from app.schemas import ContractType, PayrollPayload, PayrollResult
+
+_GLOBAL_RE = re.compile(r"\?\*([A-Z0-9_]+)\*\s*=\s*(-?[0-9.]+(?:[eE][-+]?[0-9]+)?)")
+
+# kolejność kolumn wejściowych
+_COLUMNS = (
+    "hw", "norm",
+    "f", "h", "m50", "m100",
+    "dd", "ad", "dr", "ar", "acc", "ls", "km", "kr",
+    "sen", "func", "perf", "reg", "na", "wa", "ra", "med", "car",
+    "zus", "health", "ppk", "bail",
+    "ytd",
+)
+
+_BASE_RATE = 6000.0
+_FTE = 1.0
+
+
+@lru_cache(maxsize=8)
+def load_globals(text: str) -> Dict[str, float]:
+    """Czyta wartości `defglobal` z treści pliku reguł."""
+    start = text.index("(defglobal")
+    end = text.index("(deftemplate", start)
+    return {name: float(value) for name, value in _GLOBAL_RE.findall(text[start:end])}
+
+
+def _pct_or_default(val) -> float:
+    return -1.0 if val is None else float(val)
+
+
+def _row(p: PayrollPayload) -> tuple:
+    ot, tr, al, de, ts = p.overtime, p.travel, p.allowances, p.deductions, p.timesheet
+    return (
+        float(ts.hoursWorked), float(ts.publicHolidaysInPeriod or 160),
+        float(ot.overtime50h), float(ot.overtime100h),
+        float(ot.overtime50Multiplier), float(ot.overtime100Multiplier),
+        float(tr.travelDaysDomestic), float(tr.travelDaysAbroad),
+        float(tr.dietRateDomestic), float(tr.dietRateAbroad),
+        float(tr.accommodationCost), float(tr.lumpSumTransport),
+        float(tr.privateCarKm), float(tr.privateCarRatePerKm),
+        float(al.seniorityBonusPct), float(al.functionAllowance),
+        float(al.performanceBonus), float(al.regulationBonus),
+        float(al.nightWorkAllowance), float(al.weekendHolidayAllowance),
+        float(al.remoteWorkAllowance), float(al.medicalBenefitValue),
+        float(al.companyCarBenefitValue),
+        _pct_or_default(de.employeeSocialInsurancePct),
+        _pct_or_default(de.healthInsurancePct),
+        _pct_or_default(de.ppkEmployeePct),
+        float(de.bailDeduction),
+        float(p.tax.ytdGross),
+    )
+
+
+# ───────────────────────────────────────────────────────────
+#  OBLICZENIA KOLUMNOWE
+# ───────────────────────────────────────────────────────────
+
+def compute(payloads: Sequence[PayrollPayload], g: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """Zwraca kolumny wynikowe (nazwy slotów z `payroll.clp`)."""
+    n = len(payloads)
+    data = np.array([_row(p) for p in payloads], dtype=np.float64).reshape(n, len(_COLUMNS))
+    c = {name: data[:, i] for i, name in enumerate(_COLUMNS)}
+
+    ct = np.array([p.employee.contractType.value for p in payloads])
+    student = np.array([p.employee.isStudent for p in payloads], dtype=bool)
+    uop = ct == ContractType.EMPLOYMENT.value
+    b2b = ct == ContractType.B2B.value
+    zlec = ct == ContractType.COMMISSION.value
+    dzielo = ct == ContractType.WORK.value
+
+    # 1. calc-base
+    hw, norm = c["hw"], c["norm"]
+    base = np.where(hw != norm, hw / norm * _BASE_RATE * _FTE, _BASE_RATE * _FTE)
+
+    # 2. calc-overtime
+    rate = base / norm
+    overtime = c["f"] * rate * (c["m50"] - 1) + c["h"] * rate * (c["m100"] - 1)
+
+    # 3. calc-travel
+    diet = c["dd"] * c["dr"] + c["ad"] * c["ar"]
+    travel = diet + c["acc"] + c["ls"] + c["km"] * c["kr"]
+
+    # 4. calc-allowances
+    allow = (base * c["sen"] + c["func"] + c["perf"] + c["reg"] + c["na"]
+             + c["wa"] + c["ra"] + c["med"] + c["car"])
+
+    # 5. calc-gross
+    gross = base + overtime + travel + allow
+
+    # 6. tax-adv-*
+    thr = g["TAX_HI_THRESHOLD"]
+    emp_work = (uop | dzielo) & ~student
+    commission = zlec & ~student
+    room = np.maximum(0.0, thr - c["ytd"])
+    tax_emp = (np.minimum(gross, room) * g["TAX_ADV_PCT_LO"]
+               + np.where(gross > room, (gross - room) * g["TAX_ADV_PCT_HI"], 0.0))
+    tax = np.where(emp_work, tax_emp,
+                   np.where(commission, gross * g["TAX_ADV_PCT_LO"], 0.0))
+    tax = np.where(student | b2b, 0.0, tax)
+
+    # 7. calc-deductions
+    zus_rate = np.where(c["zus"] < 0, g["SOC_INS_EMP_PCT"], c["zus"])
+    health_rate = np.where(c["health"] < 0, g["HEALTH_INS_PCT"], c["health"])
+    ppk_rate = np.where(c["ppk"] < 0, g["PPK_EMP_PCT"], c["ppk"])
+    exempt = dzielo | b2b | (zlec & student)
+
+    social = np.where(exempt | (zus_rate == 0), 0.0, gross * zus_rate)
+    health = np.where(exempt | (health_rate == 0), 0.0, gross * health_rate)
+    ppk = np.where(ppk_rate == 0, 0.0, gross * ppk_rate)
+    other = c["bail"]
+
+    # 8. calc-net
+    net = gross - social - health - ppk - other - tax
+
+    return {
+        "base-salary": base, "overtime-pay": overtime, "travel-pay": travel,
+        "allow-pay": allow, "gross": gross,
+        "social": social, "health": health, "ppk": ppk, "other": other,
+        "tax-adv": tax, "net": net,
+    }
+
+
+# ───────────────────────────────────────────────────────────
+#  GŁÓWNA FUNKCJA
+# ───────────────────────────────────────────────────────────
+
+def run_payroll_vector(
+    payloads: Sequence[PayrollPayload], rules: RuleBase
+) -> List[Union[PayrollResult, Exception]]:
+    if not payloads:
+        return []
+    cols = {k: v.tolist() for k, v in compute(payloads, load_globals(rules.text)).items()}
+    now = datetime.now(timezone.utc)
+
+    results: List[Union[PayrollResult, Exception]] = []
+    for i in range(len(payloads)):
+        # wartość nieskończona (np. przepełnienie) psuje tylko swoją pozycję
+        try:
+            social = _dec(cols["social"][i])
+            health = _dec(cols["health"][i])
+            ppk = _dec(cols["ppk"][i])
+            details: Dict[str, Decimal] = {
+                "baseSalary":       _dec(cols["base-salary"][i]),
+                "travelPay":        _dec(cols["travel-pay"][i]),
+                "socialInsurance":  social,
+                "healthInsurance":  health,
+                "ppkContribution":  ppk,
+                "social":           social,
+                "health":           health,
+                "ppk":              ppk,
+                "other":            _dec(cols["other"][i]),
+                "tax-adv":          _dec(cols["tax-adv"][i]),
+                "net":              _dec(cols["net"][i]),
+            }
+            results.append(PayrollResult(
+                gross        = _dec(cols["gross"][i]),
+                overtimePay  = _dec(cols["overtime-pay"][i]),
+                bonuses      = _dec(cols["allow-pay"][i]),
+                details      = details,
+                calculatedAt = now,
+            ))
+        except Exception as ex:  # noqa: BLE001
+            results.append(ex)
+    return results